@@ -0,0 +1,64 @@
+import pygame
+
+from constans import COLORS, SEGMENT_SIZE
+
+IMAGES = {
+    "img/background.jpg": False,
+    "img/beer.png": True,
+    "img/head.png": True,
+}
+
+_cache = {}
+_tiles = {}
+
+
+def get_image(path, alpha=None):
+    image = _cache.get(path)
+    if image is None:
+        image = load_image(path, IMAGES.get(path, True) if alpha is None else alpha)
+        _cache[path] = image
+
+    return image
+
+
+def load_image(path, alpha):
+    image = pygame.image.load(path)
+
+    # convert() needs an initialized display, so images loaded before set_mode() keep their file format
+    if pygame.display.get_surface() is not None:
+        image = image.convert_alpha() if alpha else image.convert()
+
+    return image
+
+
+def get_tile(color, head=False):
+    key = (tuple(color), head)
+    tile = _tiles.get(key)
+    if tile is None:
+        tile = create_tile(color, head)
+        _tiles[key] = tile
+
+    return tile
+
+
+def create_tile(color, head):
+    tile = pygame.Surface((SEGMENT_SIZE, SEGMENT_SIZE))
+    tile.fill(color)
+    if head:
+        tile.blit(get_image("img/head.png"), (0, 0))
+
+    if pygame.display.get_surface() is not None:
+        tile = tile.convert()
+
+    return tile
+
+
+def preload():
+    _cache.clear()
+    _tiles.clear()
+    for path, alpha in IMAGES.items():
+        _cache[path] = load_image(path, alpha)
+
+    for color in COLORS:
+        get_tile(color)
+        get_tile(color, head=True)
@@ -0,0 +1,144 @@
+import json
+import asyncio
+import logging
+
+import protocol
+from connection import Connection, NEGOTIATION_TIMEOUT
+from messages import Message
+
+
+class AsyncConnection:
+    def __init__(self, server_address="127.0.0.1", server_port=8888, binary=False):
+        self.server_address = server_address
+        self.server_port = server_port
+        self.binary = binary
+        self.reset()
+
+    def reset(self):
+        self.session_code = None
+        self.reader = None
+        self.writer = None
+        self.protocol = protocol.JSON
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def close(self):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.close()
+
+    async def connect(self):
+        player_key = await self.open()
+
+        if self.binary and not await self.negotiate_protocol():
+            # the server may still switch to binary after the timeout, so the offer is dropped with the connection
+            logging.warning("Server did not answer the binary protocol offer, reconnecting with JSON.")
+            self.close()
+            self.reset()
+            player_key = await self.open()
+
+        return player_key
+
+    async def open(self):
+        try:
+            self.reader, self.writer = await asyncio.open_connection(self.server_address, self.server_port)
+        except OSError as error:
+            # raised rather than exiting, this connection may be one of many tasks in the same process
+            raise ConnectionError("Error connecting to server. Please try again later...") from error
+
+        sockname = self.writer.get_extra_info("sockname")
+
+        return str(sockname[0]) + ":" + str(sockname[1])
+
+    async def negotiate_protocol(self):
+        self.writer.write(Connection.encode_message(Message.PROTOCOL, {"protocols": protocol.PROTOCOLS}))
+        await self.writer.drain()
+
+        try:
+            line = await asyncio.wait_for(self.reader.readuntil(b"\n"), NEGOTIATION_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return False
+
+        msg = json.loads(line)
+        if msg["type"] == Message.PROTOCOL.value and msg["data"]["protocol"] == protocol.BINARY:
+            self.protocol = protocol.BINARY
+
+        return True
+
+    async def create_session(self, player_name):
+        data = {"player_name": player_name}
+        await self.send_message(Message.CREATE_SESSION, data)
+        msg = await self.receive_message()
+
+        if msg["type"] == Message.INVALID_SESSION.value:
+            # raised rather than exiting, like connect()
+            raise ConnectionError("The server cannot open a new session right now. Please try again later...")
+
+        else:
+            self.session_code = msg["data"]["code"]
+
+    async def join_session(self, player_name, code):
+        data = {"code": code, "player_name": player_name}
+        await self.send_message(Message.JOIN_SESSION, data)
+        msg = await self.receive_message()
+
+        if msg["type"] == Message.INVALID_SESSION.value:
+            logging.error("Cannot join this session. Check if you entered the correct code and try again.")
+            exit(-1)
+
+        else:
+            self.session_code = msg["data"]["code"]
+            return msg["data"]
+
+    async def start_session(self, player_name, code):
+        # the SESSION_START reply is picked up by whoever is awaiting check_for_message()
+        data = {"code": code, "player_name": player_name}
+        await self.send_message(Message.START_SESSION, data)
+
+    async def send_message(self, msg_type, data):
+        self.post_message(msg_type, data)
+        await self.writer.drain()
+
+    def post_message(self, msg_type, data):
+        # queues the message on the transport without waiting, usable from synchronous code
+        if self.protocol == protocol.BINARY:
+            encoded = protocol.encode_frame(msg_type, data)
+        else:
+            encoded = Connection.encode_message(msg_type, data)
+
+        self.writer.write(encoded)
+        self.bytes_sent += len(encoded)
+
+    async def receive_message(self):
+        if self.protocol == protocol.BINARY:
+            try:
+                header = await self.reader.readexactly(protocol.FRAME_LENGTH.size)
+                body = await self.reader.readexactly(protocol.FRAME_LENGTH.unpack(header)[0])
+            except asyncio.IncompleteReadError:
+                raise ConnectionError("Connection closed by server")
+
+            self.bytes_received += len(header) + len(body)
+            return protocol.decode_body(memoryview(body))
+
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+
+        self.bytes_received += len(line)
+        return json.loads(line)
+
+    async def check_for_message(self):
+        msg = await self.receive_message()
+        logging.debug("Message from server: %s", msg)
+
+        return Connection.parse_message(msg)
+
+    def request_resync(self, tick):
+        data = {"tick": tick}
+        self.post_message(Message.RESYNC, data)
+
+    def send_input(self, direction, sequence=None):
+        data = {"new_direction": direction.value}
+        if sequence is not None:
+            data["sequence"] = sequence
+
+        self.post_message(Message.INPUT, data)
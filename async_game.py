@@ -0,0 +1,99 @@
+import asyncio
+
+from messages import Message
+from player import Player
+
+
+# drives the lobby and the game from an event loop: one task awaits server messages,
+# the other renders on a fixed schedule, so nothing polls the socket
+class AsyncGame:
+    def __init__(self, game):
+        self.game = game
+        self.connection = game.connection
+        self.frame_time = 1 / game.frame_rate
+        self.started = False
+        self.state_changed = False
+        self.leaderboard = None
+        self.receiver = None
+
+    def run(self, player_name, choice, code):
+        asyncio.run(self.main(player_name, choice, code))
+
+        return self.leaderboard
+
+    async def main(self, player_name, choice, code):
+        try:
+            await self.join(player_name, choice, code)
+            self.game.create_lobby()
+
+            self.receiver = asyncio.create_task(self.receive())
+            await self.render(self.draw_lobby, lambda: self.started)
+            self.game.reset_play_state()
+            await self.render(self.draw_game, lambda: self.leaderboard is not None)
+        finally:
+            if self.receiver is not None:
+                self.receiver.cancel()
+            # closed while the event loop still runs, the transport cannot be closed after asyncio.run() returns
+            self.connection.close()
+
+    async def join(self, player_name, choice, code):
+        game = self.game
+        player_key = await self.connection.connect()
+        game.player = Player(player_name, player_key)
+
+        if choice == "NEW_GAME":
+            await self.connection.create_session(game.player.name)
+            game.host = game.player
+        elif choice == "JOIN_GAME":
+            msg_data = await self.connection.join_session(game.player.name, code)
+            game.join_lobby(msg_data)
+
+    async def receive(self):
+        while True:
+            msg_type, data = await self.connection.check_for_message()
+
+            if not self.started:
+                self.started = self.game.handle_lobby_message(msg_type, data)
+            elif msg_type in (Message.SESSION_STATE_UPDATE, Message.SESSION_STATE_DELTA):
+                # states received between two frames are folded together and rendered once
+                self.state_changed |= self.game.receive_state(msg_type, data)
+            elif msg_type == Message.SESSION_END:
+                self.leaderboard = data["leaderboard"]
+                return
+
+    async def render(self, draw, done):
+        loop = asyncio.get_running_loop()
+        next_frame = loop.time()
+
+        while not done():
+            if self.receiver.done():
+                # re-raises the error that stopped the receiver, e.g. a lost connection
+                self.receiver.result()
+
+            frame_start = loop.time()
+            await draw()
+            frame_end = loop.time()
+            self.game.frame_stats.add_frame(frame_end - frame_start)
+
+            next_frame = max(next_frame + self.frame_time, frame_end)
+            await asyncio.sleep(next_frame - frame_end)
+            self.game.frame_stats.add_sleep(loop.time() - frame_end)
+
+    async def draw_lobby(self):
+        game = self.game
+        if game.start_requested:
+            game.start_requested = False
+            await self.connection.start_session(game.player.name, self.connection.session_code)
+
+        game.update_lobby()
+
+    async def draw_game(self):
+        game = self.game
+        game.handle_events()
+
+        if self.state_changed:
+            game.update_game_state(game.game_state.data())
+            self.state_changed = False
+
+        if game.apple is not None:
+            game.update_screen()
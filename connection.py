@@ -1,81 +1,220 @@
 import json
+import time
 import select
+from collections import deque
 import socket
-import pygame
 import logging
 
-from direction import Direction
+import protocol
 from messages import Message
 
+# seconds to wait for the server to answer a binary protocol offer before reconnecting with JSON
+NEGOTIATION_TIMEOUT = 1
+
 
 logging.basicConfig(format='%(asctime)s - %(message)s', datefmt='%d-%b-%y %H:%M:%S')
 
 
 class Connection:
-    def __init__(self, server_address="127.0.0.1", server_port=8888):
+    def __init__(self, server_address="127.0.0.1", server_port=8888, binary=False):
         self.server_address = server_address
         self.server_port = server_port
+        self.binary = binary
         self.reset()
 
     def reset(self):
         self.session_code = None
         self.socket = socket.socket()
         self.writer = None
-        self.reader = None
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.protocol = protocol.JSON
+        self.closed = False
 
     def connect(self):
         try:
-            self.socket.connect((self.server_address, self.server_port))
-            sockname = self.socket.getsockname()
-            player_key = str(sockname[0]) + ":" + str(sockname[1])
-            self.writer = self.socket.makefile("wb")
-            self.reader = self.socket.makefile("rb")
+            player_key = self.open()
+
+            if self.binary and not self.negotiate_protocol():
+                # the server may still switch to binary after the timeout, so the offer is dropped with the socket
+                logging.warning("Server did not answer the binary protocol offer, reconnecting with JSON.")
+                self.close()
+                self.reset()
+                player_key = self.open()
 
             return player_key
         except socket.error:
             logging.error("Error connecting to server. Please try again later...")
             exit(-1)
 
+    def open(self):
+        self.socket.connect((self.server_address, self.server_port))
+        sockname = self.socket.getsockname()
+        self.writer = self.socket.makefile("wb")
+
+        return str(sockname[0]) + ":" + str(sockname[1])
+
+    def close(self):
+        self.closed = True
+        try:
+            # shutdown() also wakes up a thread blocked in recv() on this socket
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        try:
+            if self.writer is not None:
+                self.writer.close()
+        except OSError:
+            pass
+
+        self.socket.close()
+
+    def negotiate_protocol(self):
+        # written directly, subclasses may not be able to send anything before connect() returns
+        self.writer.write(self.encode_message(Message.PROTOCOL, {"protocols": protocol.PROTOCOLS}))
+        self.writer.flush()
+
+        deadline = time.monotonic() + NEGOTIATION_TIMEOUT
+        while b"\n" not in self.buffer:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or not select.select([self.socket], [], [], timeout)[0] or not self.receive_data():
+                return False
+
+        # servers that do not know the offer may answer with something else, which is left for the game
+        end = self.buffer.index(b"\n")
+        msg = json.loads(self.buffer[:end])
+        if msg["type"] == Message.PROTOCOL.value:
+            del self.buffer[:end + 1]
+            if msg["data"]["protocol"] == protocol.BINARY:
+                self.protocol = protocol.BINARY
+
+        return True
+
     def create_session(self, player_name):
         data = {"player_name": player_name}
         self.send_message(Message.CREATE_SESSION, data)
         msg = self.receive_message()
-        self.session_code = msg["data"]["code"]
 
-    def send_message(self, msg_type, data):
-        msg = json.dumps(
-            {"type": msg_type.value, "data": data}, separators=(",", ":")
-        )
+        if msg["type"] == Message.INVALID_SESSION.value:
+            logging.error("The server cannot open a new session right now. Please try again later...")
+            exit(-1)
+
+        else:
+            self.session_code = msg["data"]["code"]
 
-        self.writer.write(f"{msg}\n".encode())
+    def send_message(self, msg_type, data):
+        self.writer.write(self.encode(msg_type, data))
         self.writer.flush()
 
+    def encode(self, msg_type, data):
+        if self.protocol == protocol.BINARY:
+            return protocol.encode_frame(msg_type, data)
+        else:
+            return self.encode_message(msg_type, data)
+
+    @staticmethod
+    def encode_message(msg_type, data):
+        return protocol.encode_json(msg_type, data)
+
     def receive_message(self):
-        response = self.reader.readline().decode()
-        # print(response)
-        msg = json.loads(response)
+        messages = self.split_messages(first_only=True)
+        while not messages:
+            if not self.receive_data():
+                raise ConnectionError("Connection closed by server")
 
-        return msg
+            messages = self.split_messages(first_only=True)
+
+        return messages[0]
+
+    def receive_data(self):
+        data = self.socket.recv(65536)
+        self.buffer += data
+        self.closed = len(data) == 0
+
+        return not self.closed
+
+    def receive_messages(self):
+        # read everything the socket has buffered, without blocking
+        while select.select([self.socket], [], [], 0)[0]:
+            if not self.receive_data():
+                break
+
+        return self.split_messages()
+
+    def split_messages(self, first_only=False):
+        # removes complete messages from the buffer, a partial one stays there until the rest arrives
+        if self.protocol == protocol.BINARY:
+            end = protocol.frames_end(self.buffer, first_only)
+            if end == 0:
+                return []
+
+            # decoded messages keep views into this copy, so the buffer itself can still be resized
+            # copied once through a view, which has to be released before the bytearray can shrink
+            view = memoryview(self.buffer)[:end]
+            data = bytes(view)
+            view.release()
+            del self.buffer[:end]
+
+            return protocol.decode_frames(data)
+
+        end = self.buffer.find(b"\n") if first_only else self.buffer.rfind(b"\n")
+        if end == -1:
+            return []
+
+        lines = self.buffer[:end].split(b"\n")
+        del self.buffer[:end + 1]
+
+        return [json.loads(line) for line in lines]
+
+    def wait_for_data(self, timeout):
+        # returns early when a message arrives, so the caller can sleep until its next deadline;
+        # a closed socket is always readable, so the caller has to check closed instead of waiting
+        if self.closed or self.pending or self.has_buffered_message():
+            return
+
+        select.select([self.socket], [], [], timeout)
+
+    def has_buffered_message(self):
+        if self.protocol == protocol.BINARY:
+            return protocol.frames_end(self.buffer, first_only=True) > 0
+        else:
+            return b"\n" in self.buffer
+
+    def check_for_messages(self):
+        messages = list(self.pending)
+        self.pending.clear()
+
+        for msg in self.receive_messages():
+            logging.debug("Message from server: %s", msg)
+            messages.append(self.parse_message(msg))
+
+        return messages
 
     def check_for_message(self):
-        response, _, _ = select.select([self.socket], [], [], 0.0001)
-        if response:
-            line = self.reader.readline().decode()
-            print("MESASGE FROM SERVER: " + line)
-            msg = json.loads(line)
-            if msg["type"] == Message.SESSION_JOIN.value:
-                players = msg["data"]["players"]
-                return Message.SESSION_JOIN, players
-            elif msg["type"] == Message.SESSION_LEAVE.value:
-                return Message.SESSION_LEAVE, msg["data"]
-            elif msg["type"] == Message.SESSION_START.value:
-                return Message.SESSION_START, None
-            elif msg["type"] == Message.SESSION_STATE_UPDATE.value:
-                return Message.SESSION_STATE_UPDATE, msg["data"]
-            elif msg["type"] == Message.SESSION_END.value:
-                return Message.SESSION_END, msg["data"]
-            else:
-                return None, None
+        if not self.pending:
+            self.pending.extend(self.check_for_messages())
+
+        if self.pending:
+            return self.pending.popleft()
+        else:
+            return None, None
+
+    @staticmethod
+    def parse_message(msg):
+        if msg["type"] == Message.SESSION_JOIN.value:
+            players = msg["data"]["players"]
+            return Message.SESSION_JOIN, players
+        elif msg["type"] == Message.SESSION_LEAVE.value:
+            return Message.SESSION_LEAVE, msg["data"]
+        elif msg["type"] == Message.SESSION_START.value:
+            return Message.SESSION_START, None
+        elif msg["type"] == Message.SESSION_STATE_UPDATE.value:
+            return Message.SESSION_STATE_UPDATE, msg["data"]
+        elif msg["type"] == Message.SESSION_STATE_DELTA.value:
+            return Message.SESSION_STATE_DELTA, msg["data"]
+        elif msg["type"] == Message.SESSION_END.value:
+            return Message.SESSION_END, msg["data"]
         else:
             return None, None
 
@@ -97,17 +236,13 @@ class Connection:
         self.send_message(Message.START_SESSION, data)
         msg = self.receive_message()
 
-    def send_direction_change(self, pressed_keys, actual_direction):
-        new_direction = actual_direction
-        if pressed_keys[pygame.K_UP] and actual_direction != Direction.DOWN:
-            new_direction = Direction.UP
-        elif pressed_keys[pygame.K_DOWN] and actual_direction != Direction.UP:
-            new_direction = Direction.DOWN
-        elif pressed_keys[pygame.K_RIGHT] and actual_direction != Direction.LEFT:
-            new_direction = Direction.RIGHT
-        elif pressed_keys[pygame.K_LEFT] and actual_direction != Direction.RIGHT:
-            new_direction = Direction.LEFT
-
-        if new_direction != actual_direction:
-            data = {"new_direction": new_direction.value}
-            self.send_message(Message.INPUT, data)
+    def request_resync(self, tick):
+        data = {"tick": tick}
+        self.send_message(Message.RESYNC, data)
+
+    def send_input(self, direction, sequence=None):
+        data = {"new_direction": direction.value}
+        if sequence is not None:
+            data["sequence"] = sequence
+
+        self.send_message(Message.INPUT, data)
@@ -1,6 +1,7 @@
 WIDTH = 800
 HEIGHT = 600
 # FPS = 15
+FRAME_RATE = 60
 SEGMENT_SIZE = 20
 WHITE = (255, 255, 255, 0)
 GREEN = (0, 100, 0)
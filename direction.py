@@ -6,3 +6,19 @@ class Direction(Enum):
     DOWN = 2
     RIGHT = 3
     LEFT = 4
+
+
+# cell steps of one move, x grows to the right and y downwards
+OFFSETS = {
+    Direction.UP: (0, -1),
+    Direction.DOWN: (0, 1),
+    Direction.RIGHT: (1, 0),
+    Direction.LEFT: (-1, 0),
+}
+
+OPPOSITES = {
+    Direction.UP: Direction.DOWN,
+    Direction.DOWN: Direction.UP,
+    Direction.RIGHT: Direction.LEFT,
+    Direction.LEFT: Direction.RIGHT,
+}
@@ -0,0 +1,36 @@
+import time
+import logging
+
+# seconds between two reports
+REPORT_INTERVAL = 5
+
+
+class FrameStats:
+    def __init__(self, report_interval=REPORT_INTERVAL):
+        self.report_interval = report_interval
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.frames = 0
+        self.frame_time = 0
+        self.slowest_frame = 0
+        self.sleep_time = 0
+
+    def add_frame(self, frame_time):
+        self.frames += 1
+        self.frame_time += frame_time
+        self.slowest_frame = max(self.slowest_frame, frame_time)
+
+        elapsed = time.perf_counter() - self.started
+        if elapsed >= self.report_interval:
+            self.report(elapsed)
+            self.reset()
+
+    def add_sleep(self, sleep_time):
+        self.sleep_time += sleep_time
+
+    def report(self, elapsed):
+        logging.info("%.1f fps, frame time avg %.2f ms / max %.2f ms, asleep %.0f%% of the time",
+                     self.frames / elapsed, 1000 * self.frame_time / self.frames, 1000 * self.slowest_frame,
+                     100 * self.sleep_time / elapsed)
@@ -1,34 +1,81 @@
 import sys
+import time
+import logging
+from itertools import islice
 from socket import socket
 
 import pygame
 import pygame_menu
-from pygame_menu import Theme
 
+import assets
+import menus
 from apple import Apple
+from async_connection import AsyncConnection
+from async_game import AsyncGame
 from connection import Connection
+from frame_stats import FrameStats
+from game_state import GameState
+from interpolation import SnapshotBuffer
+from threaded_connection import ThreadedConnection
 from messages import Message
 from player import Player
+from prediction import Predictor
+from input_queue import InputQueue
+from direction import Direction
 from constans import *
 
+KEY_DIRECTIONS = {
+    pygame.K_UP: Direction.UP,
+    pygame.K_DOWN: Direction.DOWN,
+    pygame.K_RIGHT: Direction.RIGHT,
+    pygame.K_LEFT: Direction.LEFT,
+}
+
 
 class Game:
-    def __init__(self, server_address):
+    def __init__(self, server_address, dirty_rects=False, threaded=False, use_asyncio=False, binary=False,
+                 frame_rate=FRAME_RATE, interpolation_delay=None, prediction=False):
         pygame.init()
         self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
         pygame.display.set_caption("Snake Multiplayer")
-        self.background = pygame.image.load("img/background.jpg")
+        assets.preload()
+        self.background = assets.get_image("img/background.jpg")
 
         self.server_address = server_address
+        self.dirty_rects = dirty_rects
+        self.threaded = threaded
+        self.use_asyncio = use_asyncio
+        self.binary = binary
+        self.frame_rate = frame_rate
+        self.frame_stats = FrameStats()
+        self.snapshots = SnapshotBuffer(interpolation_delay) if interpolation_delay is not None else None
+        self.predictor = Predictor() if prediction else None
+        self.inputs = InputQueue()
         self.host = None
+        self.blits_per_frame = 0
+        self.connection = None
         self.reset()
 
     def reset(self):
         self.player = None
-        self.connection = Connection(self.server_address)
-        self.opponents = []
+        if self.connection is not None:
+            self.connection.close()
+        if self.use_asyncio:
+            self.connection = AsyncConnection(self.server_address, binary=self.binary)
+        elif self.threaded:
+            self.connection = ThreadedConnection(self.server_address, binary=self.binary)
+        else:
+            self.connection = Connection(self.server_address, binary=self.binary)
+        self.opponents = {}
         self.apple = None
+        self.game_state = GameState()
         self.menu = None
+        self.drawn_cells = None
+        self.dirty_cells = set()
+        self.cells_rebuilt = False
+        self.state_changed = False
+        self.start_requested = False
+        self.lobby_changed = False
 
     def show_menu(self):
         if self.menu is not None:
@@ -43,19 +90,7 @@ class Game:
 
     @staticmethod
     def set_menu_parameters(font_size, title, margin=(0, 30)):
-        font = pygame_menu.font.FONT_OPEN_SANS_BOLD
-        my_theme = Theme(title_font=font, widget_font=font, widget_font_size=font_size, widget_margin=margin,
-                         title_font_color=WHITE, widget_font_color=WHITE,
-                         title_background_color=GREEN,
-                         selection_color=WHITE,
-                         focus_background_color=GREEN,
-                         background_color=pygame_menu.baseimage.BaseImage(
-                             image_path="img/background.jpg",
-                             drawing_mode=pygame_menu.baseimage.IMAGE_MODE_REPEAT_XY
-                         ))
-        menu = pygame_menu.Menu(title, 800, 600, theme=my_theme)
-
-        return menu
+        return menus.create_menu(title, font_size, margin)
 
     def menu_with_input(self, choice):
         self.menu.disable()
@@ -75,6 +110,18 @@ class Game:
 
     def lobby(self, player_input, choice, code):
         # self.menu.disable()
+        if self.use_asyncio:
+            try:
+                leaderboard = AsyncGame(self).run(player_input.get_value(), choice,
+                                                  code.get_value() if code is not None else None)
+            except ConnectionError as error:
+                logging.error(error)
+                self.show_menu()
+                return
+
+            self.show_end_screen(leaderboard)
+            return
+
         player_key = self.connection.connect()
         self.player = Player(player_input.get_value(), player_key)
 
@@ -83,52 +130,112 @@ class Game:
             self.host = self.player
         elif choice == "JOIN_GAME":
             msg_data = self.connection.join_session(self.player.name, code.get_value())
-            self.player.name = msg_data["player"]["name"]
-            self.add_opponents(msg_data["players"])
-            self.find_host(msg_data["owner_key"])
+            self.join_lobby(msg_data)
+
+        self.create_lobby()
+        frame_time = 1 / self.frame_rate
 
         while True:
-            result = self.connection.check_for_message()
-            if result is not None:
-                if result[0] == Message.SESSION_JOIN:
-                    self.add_opponents(result[1])
-                elif result[0] == Message.SESSION_LEAVE:
-                    self.remove_opponent(result[1]["key"])
-                    self.find_host(result[1]["owner_key"])
-                elif result[0] == Message.SESSION_START:
+            # messages are taken one by one, so the ones following SESSION_START are left for play()
+            msg_type, data = self.connection.check_for_message()
+            while msg_type is not None:
+                if self.handle_lobby_message(msg_type, data):
                     self.play()
-                    break
+                    return
 
-            self.update_lobby()
+                msg_type, data = self.connection.check_for_message()
 
-    def update_lobby(self):
+            if self.connection.closed:
+                self.connection_lost()
+                return
+
+            frame_start = time.perf_counter()
+            self.update_lobby()
+            # nothing happens in the lobby until a message or an input event arrives
+            self.connection.wait_for_data(max(0, frame_time - (time.perf_counter() - frame_start)))
+
+    def join_lobby(self, msg_data):
+        self.player.name = msg_data["player"]["name"]
+        self.add_opponents(msg_data["players"])
+        self.find_host(msg_data["owner_key"])
+
+    def handle_lobby_message(self, msg_type, data):
+        if msg_type == Message.SESSION_JOIN:
+            self.add_opponents(data)
+            self.lobby_changed = True
+        elif msg_type == Message.SESSION_LEAVE:
+            self.remove_opponent(data["key"])
+            self.find_host(data["owner_key"])
+            self.lobby_changed = True
+
+        return msg_type == Message.SESSION_START
+
+    def create_lobby(self):
+        # every widget the lobby can show is created once, refresh_lobby() only changes texts and visibility
         self.menu = self.set_menu_parameters(30, "Lobby", (0, 10))
         self.menu.add.label("Waiting players:")
+        self.lobby_labels = [self.menu.add.label("") for _ in range(4)]
+        self.others_label = self.menu.add.label("")
+        self.host_widgets = [
+            self.menu.add.label(""),
+            self.menu.add.label("Pass it to your friends so they can join the game!"),
+            self.menu.add.button("Start game", self.start, background_color=GREEN)
+        ]
+        self.wait_label = self.menu.add.label("Wait for the host to start a game...")
+        self.lobby_changed = True
+
+    def refresh_lobby(self):
         info = " (you)"
         info += " (host)" if self.player == self.host else ""
-        self.menu.add.label("- " + self.player.name + info)
+        names = ["- " + self.player.name + info]
 
-        for i in range(min(3, len(self.opponents))):
-            info = " (host)" if self.opponents[i] == self.host else ""
-            self.menu.add.label("- " + self.opponents[i].name + info)
+        opponents = list(self.opponents.values())
+        for i in range(min(3, len(opponents))):
+            info = " (host)" if opponents[i] == self.host else ""
+            names.append("- " + opponents[i].name + info)
 
-        if len(self.opponents) > 3:
-            others = len(self.opponents) - 3
-            self.menu.add.label("and " + str(others) + " others")
+        for label, name in zip(self.lobby_labels, names + [None] * len(self.lobby_labels)):
+            self.set_label(label, name)
 
-        if self.player == self.host:
-            self.menu.add.label("Your lobby code: " + self.connection.session_code)
-            self.menu.add.label("Pass it to your friends so they can join the game!")
-            self.menu.add.button("Start game", self.start, background_color=GREEN)
+        others = len(opponents) - 3
+        self.set_label(self.others_label, "and " + str(others) + " others" if others > 0 else None)
+
+        is_host = self.player == self.host
+        if is_host:
+            self.host_widgets[0].set_title("Your lobby code: " + self.connection.session_code)
+
+        for widget in self.host_widgets:
+            if is_host:
+                widget.show()
+            else:
+                widget.hide()
 
+        if is_host:
+            self.wait_label.hide()
         else:
-            self.menu.add.label("Wait for the host to start a game...")
+            self.wait_label.show()
 
+    @staticmethod
+    def set_label(label, title):
+        if title is None:
+            label.hide()
+        else:
+            label.set_title(title)
+            label.show()
+
+    def update_lobby(self):
         events = pygame.event.get()
         for event in events:
             if event.type == pygame.QUIT:
                 exit()
 
+        if not events and not self.lobby_changed:
+            return
+
+        if self.lobby_changed:
+            self.refresh_lobby()
+            self.lobby_changed = False
+
         if self.menu.is_enabled():
             self.menu.update(events)
             self.menu.draw(self.screen)
@@ -139,69 +246,276 @@ class Game:
         self.opponents.clear()
         for opponent in players:
             if opponent["name"] != self.player.name:
-                self.opponents.append(Player(opponent["name"], opponent["key"]))
+                self.opponents[opponent["key"]] = Player(opponent["name"], opponent["key"])
 
     def remove_opponent(self, key):
-        for opponent in self.opponents:
-            if opponent.key == key:
-                self.opponents.remove(opponent)
-                break
+        self.opponents.pop(key, None)
 
     def find_host(self, host_key):
         if self.player.key == host_key:
             self.host = self.player
-        else:
-            for opponent in self.opponents:
-                if opponent.key == host_key:
-                    self.host = opponent
-                    break
+        elif host_key in self.opponents:
+            self.host = self.opponents[host_key]
 
     def start(self):
+        if self.use_asyncio:
+            # the event loop sends START_SESSION, the menu callback cannot await it
+            self.start_requested = True
+            return
+
         self.connection.start_session(self.player.name, self.connection.session_code)
         self.play()
 
+    def reset_play_state(self):
+        # state kept across games in this process, cleared when a new one starts
+        self.drawn_cells = None
+        self.dirty_cells = set()
+        self.cells_rebuilt = False
+        if self.snapshots is not None:
+            self.snapshots.clear()
+
+        self.inputs.reset()
+        if self.predictor is not None:
+            self.predictor.reset()
+
     def play(self):
-        result = self.connection.check_for_message()
-        if result is not None and result[0] == Message.SESSION_STATE_UPDATE:
-            self.update_game_state(result[1])
-            while True:
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        pygame.quit()
-                        sys.exit()
-
-                # if not self.check_game_over():
+        self.reset_play_state()
+        frame_time = 1 / self.frame_rate
+        next_frame = time.perf_counter()
+
+        while True:
+            # the frame time covers the input, messages and state applied on this pass, as in AsyncGame.render
+            frame_start = time.perf_counter()
+            self.handle_events()
+
+            # the whole batch is folded into one state, so only the newest one gets applied to the game
+            state_changed = False
+            for msg_type, data in self.connection.check_for_messages():
+                if msg_type in (Message.SESSION_STATE_UPDATE, Message.SESSION_STATE_DELTA):
+                    state_changed |= self.receive_state(msg_type, data)
+                elif msg_type == Message.SESSION_END:
+                    self.show_end_screen(data["leaderboard"])
+                    return
+
+            if self.connection.closed:
+                self.connection_lost()
+                return
+
+            if state_changed:
+                self.update_game_state(self.game_state.data())
+
+            now = time.perf_counter()
+            if now < next_frame:
+                # new messages wake the loop early, they are applied on the next pass
+                self.connection.wait_for_data(next_frame - now)
+                self.frame_stats.add_sleep(time.perf_counter() - now)
+                continue
+
+            if self.apple is not None:
                 self.update_screen()
 
-                result = self.connection.check_for_message()
-                if result is not None:
-                    if result[0] == Message.SESSION_STATE_UPDATE:
-                        self.update_game_state(result[1])
-                    elif result[0] == Message.SESSION_END:
-                        self.show_end_screen(result[1]["leaderboard"])
-                        break
+            frame_end = time.perf_counter()
+            self.frame_stats.add_frame(frame_end - frame_start)
+            # a late frame moves the schedule instead of rendering several frames in a row to catch up
+            next_frame = max(next_frame + frame_time, frame_end)
 
-        else:
-            self.play()
+    def connection_lost(self):
+        logging.error("Connection to server lost.")
+        self.show_menu()
+
+    def receive_state(self, msg_type, data):
+        if msg_type == Message.SESSION_STATE_UPDATE:
+            self.game_state.load(data)
+            return True
+
+        # deltas after a gap are useless until the keyframe asked for below arrives
+        if self.game_state.awaiting_keyframe:
+            return False
+
+        if self.game_state.apply_delta(data):
+            return True
+
+        self.connection.request_resync(self.game_state.tick)
+        return False
+
+    def handle_events(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            elif event.type == pygame.KEYDOWN and event.key in KEY_DIRECTIONS:
+                self.turn(KEY_DIRECTIONS[event.key])
+
+    def turn(self, direction):
+        if self.player is not None and self.player.is_alive:
+            self.inputs.push(direction)
+            self.send_queued_input()
 
     def update_screen(self):
-        self.screen.blit(self.background, (0, 0))
+        if self.dirty_rects:
+            self.update_dirty_cells()
+        else:
+            self.draw_batch([(self.background, (0, 0))] + self.frame_sequence())
+            pygame.display.update()
 
-        if self.player.is_alive:
-            self.player.snake.draw(self.screen)
+    def send_queued_input(self):
+        direction = self.inputs.pop()
+        if direction is None:
+            return
 
-        for opponent in self.opponents:
-            opponent.snake.draw(self.screen)
+        if self.predictor is not None:
+            self.connection.send_input(direction, self.predictor.add_input(direction))
+        else:
+            self.connection.send_input(direction)
 
-        self.apple.draw(self.screen)
+    def frame_sequence(self):
+        sequence = []
+        frame = self.snapshots.frame() if self.snapshots is not None else None
 
         if self.player.is_alive:
-            self.connection.send_direction_change(pygame.key.get_pressed(), self.player.snake.direction)
+            sequence.extend(self.snake_sequence(self.player, frame))
 
-        pygame.display.update()
+        for opponent in self.opponents.values():
+            sequence.extend(self.snake_sequence(opponent, frame))
+
+        sequence.extend(self.apple.blit_sequence())
+
+        return sequence
+
+    def snake_sequence(self, player, frame):
+        # the local snake is drawn ahead of the server, the others (optionally) behind it
+        if player is self.player and self.predictor is not None:
+            return self.predictor.blit_sequence(player.snake)
+
+        if frame is None:
+            return player.snake.blit_sequence()
+
+        return self.snapshots.blit_sequence(player.key, player.snake, *frame)
+
+    def animated(self):
+        # interpolated and predicted snakes keep moving between server states
+        return self.snapshots is not None or self.predictor is not None
+
+    def update_dirty_cells(self):
+        animated = self.animated()
+        if not self.state_changed and self.drawn_cells is not None and not animated:
+            return
+
+        if self.drawn_cells is not None and not animated and not self.cells_rebuilt:
+            # track_cells() already put the new surfaces of the changed cells into drawn_cells
+            self.draw_cells(self.dirty_cells)
+            self.dirty_cells = set()
+            self.state_changed = False
+            return
+
+        sequence = self.frame_sequence()
+        # later blits cover earlier ones, so each cell keeps only the surface that ends up on top
+        cells = {position: surface for surface, position in sequence}
+
+        if self.drawn_cells is None:
+            self.draw_batch([(self.background, (0, 0))] + sequence)
+            pygame.display.update()
+        else:
+            dirty = {position for position, surface in cells.items() if self.drawn_cells.get(position) is not surface}
+            dirty.update(position for position in self.drawn_cells if position not in cells)
+            # cells changed by states applied since the last frame, drawn_cells already holds their new surfaces
+            dirty.update(self.dirty_cells)
+
+            # interpolated tiles lie between grid cells: they are redrawn last, over every cell they touch
+            sliding = [position for position in cells if not self.on_grid(position)]
+            for position in [position for position in dirty if not self.on_grid(position)] + sliding:
+                dirty.update(self.covered_cells(position))
+
+            if dirty:
+                rects = [pygame.Rect(position, (SEGMENT_SIZE, SEGMENT_SIZE)) for position in dirty]
+                batch = [(self.background, rect, rect) for rect in rects]
+                batch.extend((cells[position], position) for position in dirty
+                             if position in cells and self.on_grid(position))
+                batch.extend((cells[position], position) for position in sliding)
+                self.draw_batch(batch)
+                pygame.display.update(rects)
+
+        self.drawn_cells = cells
+        self.dirty_cells = set()
+        self.cells_rebuilt = False
+        self.state_changed = False
+
+    def draw_cells(self, dirty):
+        if not dirty:
+            return
+
+        rects = [pygame.Rect(position, (SEGMENT_SIZE, SEGMENT_SIZE)) for position in dirty]
+        batch = [(self.background, rect, rect) for rect in rects]
+        batch.extend((self.drawn_cells[position], position) for position in dirty if position in self.drawn_cells)
+        self.draw_batch(batch)
+        pygame.display.update(rects)
+
+    def track_cells(self, snakes, old_apple):
+        # a state without animation changes only the new heads, the old head, the trimmed tails and the apple,
+        # so drawn_cells is updated in place; alive snakes never share a cell, so no other surface is lost
+        if not self.dirty_rects or self.animated() or self.drawn_cells is None or self.cells_rebuilt:
+            return
+
+        if any(snake.changes is None for snake in snakes):
+            self.cells_rebuilt = True
+            return
+
+        cells = {position for _, position in self.apple.blit_sequence()}
+        if old_apple is not None:
+            cells.add(old_apple)
+
+        for snake in snakes:
+            added, trimmed = snake.changes
+            cells.update(trimmed)
+            cells.update(segment.position for segment in islice(snake.segments, added + 1))
+
+        for position in cells:
+            self.drawn_cells.pop(position, None)
+
+        for snake in snakes:
+            added, _ = snake.changes
+            for segment in islice(snake.segments, added + 1):
+                self.drawn_cells[segment.position] = snake.tile
+            self.drawn_cells[snake.head.position] = snake.head_tile
+
+        for surface, position in self.apple.blit_sequence():
+            self.drawn_cells[position] = surface
+
+        self.dirty_cells.update(cells)
+
+    @staticmethod
+    def on_grid(position):
+        return position[0] % SEGMENT_SIZE == 0 and position[1] % SEGMENT_SIZE == 0
+
+    @staticmethod
+    def covered_cells(position):
+        x = position[0] - position[0] % SEGMENT_SIZE
+        y = position[1] - position[1] % SEGMENT_SIZE
+        xs = (x, x + SEGMENT_SIZE) if position[0] % SEGMENT_SIZE else (x,)
+        ys = (y, y + SEGMENT_SIZE) if position[1] % SEGMENT_SIZE else (y,)
+
+        return [(cell_x, cell_y) for cell_x in xs for cell_y in ys]
+
+    def draw_batch(self, sequence):
+        # fblits (pygame-ce) skips building the list of changed rects that blits returns
+        fblits = getattr(self.screen, "fblits", None)
+        if fblits is not None:
+            fblits(sequence)
+        else:
+            self.screen.blits(sequence, doreturn=False)
+
+        self.blits_per_frame = len(sequence)
+        logging.debug("Blits per frame: %d", self.blits_per_frame)
 
     def update_game_state(self, data):
-        self.apple = Apple(data["apples"][0])
+        self.state_changed = True
+        old_apple = None
+        if self.apple is None:
+            self.apple = Apple(data["apples"][0])
+        else:
+            old_apple = self.apple.rect.topleft
+            self.apple.move(data["apples"][0])
+
         alive_players = data["alive_players"]
         is_player_alive = False
 
@@ -209,17 +523,56 @@ class Game:
             if alive_player["key"] == self.player.key:
                 is_player_alive = True
                 self.player.snake.update_segments(alive_player["chunks"], alive_player["direction"])
+                self.inputs.on_state(self.player.snake.direction)
+
+                if self.predictor is not None:
+                    self.predictor.reconcile(self.player.snake.direction, alive_player.get("last_input"))
+
+                # a turn queued during the previous tick goes out as soon as the new one starts
+                self.send_queued_input()
 
         if not is_player_alive:
+            # the whole snake disappears, which only the full diff of the next frame clears
+            self.cells_rebuilt |= self.player.is_alive
             self.player.is_alive = False
+            self.track_cells([], old_apple)
 
         else:
-            alive_opponents = []
-            for alive_player in alive_players:
-                alive_opponents.append(Player(alive_player["name"], alive_player["key"]))
-                alive_opponents[-1].snake.update_segments(alive_player["chunks"], alive_player["direction"])
+            self.cells_rebuilt |= self.update_opponents(alive_players)
+            self.track_cells([self.player.snake] + [opponent.snake for opponent in self.opponents.values()],
+                             old_apple)
+
+        if self.snapshots is not None:
+            changes = {opponent.key: opponent.snake.changes for opponent in self.opponents.values()}
+            if self.player.is_alive:
+                changes[self.player.key] = self.player.snake.changes
+
+            self.snapshots.push(changes)
+
+    def update_opponents(self, alive_players):
+        # opponents persist between states, so their snakes only apply what changed since the last one;
+        # returns whether anyone joined or left
+        joined_or_left = False
+        for alive_player in alive_players:
+            key = alive_player["key"]
+            if key == self.player.key:
+                continue
+
+            opponent = self.opponents.get(key)
+            if opponent is None:
+                opponent = self.opponents[key] = Player(alive_player["name"], key)
+                joined_or_left = True
+
+            opponent.snake.update_segments(alive_player["chunks"], alive_player["direction"])
+
+        # alive_players also holds the local player, so only a registry at least that large has someone who left
+        if len(self.opponents) >= len(alive_players):
+            alive_keys = {alive_player["key"] for alive_player in alive_players}
+            for key in [key for key in self.opponents if key not in alive_keys]:
+                del self.opponents[key]
+                joined_or_left = True
 
-            self.opponents = alive_opponents
+        return joined_or_left
 
     def show_game_over_screen(self):
         self.menu = self.set_menu_parameters(70, "The end")
@@ -0,0 +1,64 @@
+from collections import deque
+
+
+# latest session state rebuilt from keyframes (SESSION_STATE_UPDATE) and deltas (SESSION_STATE_DELTA)
+#
+# a delta lists every alive player: newcomers carry their full "chunks", everyone else only the
+# "head" cells added in front of the snake (newest first) and the number of tail cells to "trim";
+# "apples" are only sent when they changed, and "base_tick" has to be the tick applied last
+class GameState:
+    def __init__(self):
+        self.tick = None
+        self.apples = []
+        self.players = {}
+        self.awaiting_keyframe = False
+
+    def load(self, data):
+        self.tick = data.get("tick")
+        self.apples = data["apples"]
+        self.players = {player["key"]: player for player in data["alive_players"]}
+        self.awaiting_keyframe = False
+
+    def apply_delta(self, data):
+        if self.awaiting_keyframe or data["base_tick"] != self.tick:
+            self.awaiting_keyframe = True
+            return False
+
+        players = {}
+        for change in data["players"]:
+            if "chunks" in change:
+                players[change["key"]] = change
+                continue
+
+            player = self.players.get(change["key"])
+            if player is None or change["trim"] > len(player["chunks"]):
+                self.awaiting_keyframe = True
+                return False
+
+            players[change["key"]] = player
+
+        for change in data["players"]:
+            player = players[change["key"]]
+            if player is change:
+                continue
+
+            chunks = player["chunks"]
+            # keyframe chunks are lists or protocol.Chunks, they are turned into deques once, on their first delta
+            if not isinstance(chunks, deque):
+                chunks = player["chunks"] = deque(chunks)
+
+            for _ in range(change["trim"]):
+                chunks.pop()
+
+            chunks.extendleft(reversed(change["head"]))
+            player["direction"] = change["direction"]
+
+        self.tick = data["tick"]
+        self.players = players
+        if "apples" in data:
+            self.apples = data["apples"]
+
+        return True
+
+    def data(self):
+        return {"apples": self.apples, "alive_players": list(self.players.values())}
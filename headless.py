@@ -0,0 +1,109 @@
+import time
+import random
+
+from connection import Connection
+from direction import Direction
+from game_state import GameState
+from input_queue import InputQueue
+from messages import Message
+
+# chance of turning on every server state
+TURN_CHANCE = 0.2
+
+
+# plays through the lobby and the game without pygame: the choices the menus would ask for are passed in,
+# and the snake turns at random, which is enough to load a server with many clients on one machine
+class HeadlessClient:
+    def __init__(self, server_address, player_name="Bot", binary=False, turn_chance=TURN_CHANCE):
+        self.connection = Connection(server_address, binary=binary)
+        self.player_name = player_name
+        self.turn_chance = turn_chance
+        self.player_key = None
+        self.players = 0
+        self.game_state = GameState()
+        self.inputs = InputQueue()
+        self.states = 0
+
+    def run(self, code=None, start_players=1, start_after=None):
+        self.player_key = self.connection.connect()
+
+        if code is None:
+            self.connection.create_session(self.player_name)
+            self.players = 1
+            print(self.connection.session_code, flush=True)
+            self.wait_for_players(start_players, start_after)
+            self.connection.start_session(self.player_name, self.connection.session_code)
+        else:
+            msg_data = self.connection.join_session(self.player_name, code)
+            self.players = len(msg_data["players"])
+            self.wait_for_start()
+
+        return self.play()
+
+    def wait_for_players(self, start_players, start_after):
+        deadline = time.monotonic() + start_after if start_after is not None else None
+
+        while self.players < start_players and (deadline is None or time.monotonic() < deadline):
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            self.connection.wait_for_data(timeout)
+            for msg_type, data in self.connection.check_for_messages():
+                self.handle_lobby_message(msg_type, data)
+
+            self.check_connection()
+
+    def check_connection(self):
+        if self.connection.closed:
+            raise ConnectionError("Connection closed by server")
+
+    def wait_for_start(self):
+        while True:
+            msg_type, data = self.connection.check_for_message()
+            if msg_type == Message.SESSION_START:
+                return
+
+            if msg_type is None:
+                self.connection.wait_for_data(None)
+                self.check_connection()
+            else:
+                self.handle_lobby_message(msg_type, data)
+
+    def handle_lobby_message(self, msg_type, data):
+        if msg_type == Message.SESSION_JOIN:
+            self.players = len(data)
+        elif msg_type == Message.SESSION_LEAVE:
+            self.players -= 1
+
+    def play(self):
+        while True:
+            self.connection.wait_for_data(None)
+            self.check_connection()
+
+            state_changed = False
+            for msg_type, data in self.connection.check_for_messages():
+                if msg_type == Message.SESSION_STATE_UPDATE:
+                    self.game_state.load(data)
+                    state_changed = True
+                elif msg_type == Message.SESSION_STATE_DELTA and not self.game_state.awaiting_keyframe:
+                    if self.game_state.apply_delta(data):
+                        state_changed = True
+                    else:
+                        self.connection.request_resync(self.game_state.tick)
+                elif msg_type == Message.SESSION_END:
+                    return data["leaderboard"]
+
+            if state_changed:
+                self.states += 1
+                self.update()
+
+    def update(self):
+        player = self.game_state.players.get(self.player_key)
+        if player is None:
+            return
+
+        self.inputs.on_state(Direction(player["direction"]))
+        if random.random() < self.turn_chance:
+            self.inputs.push(random.choice(list(Direction)))
+
+        direction = self.inputs.pop()
+        if direction is not None:
+            self.connection.send_input(direction)
@@ -0,0 +1,57 @@
+from collections import deque
+
+from direction import OPPOSITES
+
+# turns waiting for their server tick, more key presses than that are ignored
+MAX_QUEUED_TURNS = 3
+# states after which a turn the server never applied is forgotten
+INPUT_TIMEOUT = 3
+
+
+# sends at most one turn per server state, so turns pressed faster than the server ticks (e.g. two
+# quick turns making a U-turn) are queued instead of replacing each other, and a held key sends nothing
+class InputQueue:
+    def __init__(self):
+        self.queued = deque()
+        self.reset()
+
+    def reset(self):
+        self.queued.clear()
+        self.direction = None
+        self.last_sent = None
+        self.sent_this_tick = False
+        self.states_since_sent = 0
+
+    def current(self):
+        # the direction the snake will have once everything pressed so far is applied
+        if self.queued:
+            return self.queued[-1]
+        elif self.last_sent is not None:
+            return self.last_sent
+        else:
+            return self.direction
+
+    def push(self, direction):
+        current = self.current()
+        if current is None or direction in (current, OPPOSITES[current]) or len(self.queued) >= MAX_QUEUED_TURNS:
+            return
+
+        self.queued.append(direction)
+
+    def pop(self):
+        if self.sent_this_tick or not self.queued:
+            return None
+
+        self.last_sent = self.queued.popleft()
+        self.sent_this_tick = True
+        self.states_since_sent = 0
+
+        return self.last_sent
+
+    def on_state(self, server_direction):
+        self.direction = server_direction
+        self.sent_this_tick = False
+        self.states_since_sent += 1
+
+        if self.last_sent == server_direction or self.states_since_sent > INPUT_TIMEOUT:
+            self.last_sent = None
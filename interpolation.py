@@ -0,0 +1,88 @@
+import time
+from collections import deque
+from itertools import islice
+
+SNAPSHOT_COUNT = 8
+# seconds the rendered snakes lag behind the newest server state
+INTERPOLATION_DELAY = 0.1
+
+
+# keeps what every snake changed in the last few states (see Snake.changes) with the time they arrived,
+# which is enough to step a snake back from its current segments to the moment being rendered
+class SnapshotBuffer:
+    def __init__(self, delay=INTERPOLATION_DELAY, size=SNAPSHOT_COUNT):
+        self.delay = delay
+        self.snapshots = deque(maxlen=size)
+
+    def clear(self):
+        self.snapshots.clear()
+
+    def push(self, changes):
+        self.snapshots.append((time.perf_counter(), changes))
+
+    def frame(self):
+        # snapshots newer than the render time (newest first) and how far the oldest of them has progressed
+        render_time = time.perf_counter() - self.delay
+        future = []
+        arrived = None
+        previous = None
+
+        for timestamp, changes in reversed(self.snapshots):
+            if timestamp <= render_time:
+                previous = timestamp
+                break
+
+            future.append(changes)
+            arrived = timestamp
+
+        if not future or previous is None:
+            return future, 0
+
+        return future, (render_time - previous) / (arrived - previous)
+
+    @staticmethod
+    def blit_sequence(key, snake, future, progress):
+        changes = [snapshot.get(key) for snapshot in future]
+        if not changes or None in changes:
+            return snake.blit_sequence()
+
+        segments = snake.segments
+        later_added = sum(change[0] for change in changes[:-1])
+        added, trimmed = changes[-1]
+        old_head = later_added + added
+        if old_head >= len(segments):
+            return snake.blit_sequence()
+
+        # the snake as it was before the snapshot being animated: later heads dropped, later tails restored
+        positions = [segment.position for segment in islice(segments, old_head, None)]
+        for _, later_trimmed in changes[:-1]:
+            positions.extend(reversed(later_trimmed))
+
+        sequence = [(snake.tile, position) for position in positions]
+
+        # the tail end was trimmed first, so it is the first cell to disappear
+        removed = progress * len(trimmed)
+        gone = int(removed)
+        if gone < len(trimmed):
+            sequence.extend((snake.tile, position) for position in reversed(trimmed[gone + 1:]))
+            towards = trimmed[gone + 1] if gone + 1 < len(trimmed) else positions[-1]
+            sequence.append((snake.tile, lerp(trimmed[gone], towards, removed - gone)))
+
+        # new cells ordered from the old head outwards, the head slides over them
+        new_cells = [segment.position for segment in islice(segments, later_added, old_head)]
+        new_cells.reverse()
+        revealed = progress * added
+        shown = int(revealed)
+        sequence.extend((snake.tile, position) for position in new_cells[:shown])
+
+        head = new_cells[shown - 1] if shown > 0 else positions[0]
+        if shown < added:
+            head = lerp(head, new_cells[shown], revealed - shown)
+
+        sequence.append((snake.head_tile, head))
+        return sequence
+
+
+def lerp(start, end, progress):
+    return (round(start[0] + (end[0] - start[0]) * progress),
+            round(start[1] + (end[1] - start[1]) * progress))
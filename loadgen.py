@@ -0,0 +1,200 @@
+import time
+import random
+import asyncio
+import logging
+import argparse
+
+from async_connection import AsyncConnection
+from direction import Direction
+from game_state import GameState
+from input_queue import InputQueue
+from messages import Message
+from headless import TURN_CHANCE
+
+# seconds between two reports while the sessions are running
+REPORT_INTERVAL = 5
+# seconds between connecting two sessions, so the server is not hit by every client at once
+SESSION_RAMP = 0.05
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class LoadStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.connections = []
+        self.messages = 0
+        self.states = 0
+        self.latencies = []
+        self.reset()
+
+    def reset(self):
+        self.interval_started = time.perf_counter()
+        self.interval_messages = 0
+        self.interval_states = 0
+        self.interval_latencies = []
+        self.interval_bytes = self.count_bytes()
+
+    def count_bytes(self):
+        return (sum(connection.bytes_received for connection in self.connections),
+                sum(connection.bytes_sent for connection in self.connections))
+
+    def add_message(self, is_state):
+        self.messages += 1
+        self.interval_messages += 1
+        if is_state:
+            self.states += 1
+            self.interval_states += 1
+
+    def add_latency(self, latency):
+        self.latencies.append(latency)
+        self.interval_latencies.append(latency)
+
+    def report(self):
+        elapsed = time.perf_counter() - self.interval_started
+        received, sent = self.count_bytes()
+        self.log(elapsed, self.interval_messages, self.interval_states, self.interval_latencies,
+                 received - self.interval_bytes[0], sent - self.interval_bytes[1])
+        self.reset()
+
+    def report_total(self):
+        received, sent = self.count_bytes()
+        logging.info("total over %d connections:", len(self.connections))
+        self.log(time.perf_counter() - self.started, self.messages, self.states, self.latencies, received, sent)
+
+    @staticmethod
+    def log(elapsed, messages, states, latencies, received, sent):
+        latencies = sorted(latencies)
+        logging.info("%.0f msg/s (%.0f states/s), in %.1f KB/s, out %.1f KB/s, "
+                     "input->state latency p50 %.1f ms / p90 %.1f ms / p99 %.1f ms / max %.1f ms (%d inputs)",
+                     messages / elapsed, states / elapsed, received / elapsed / 1024, sent / elapsed / 1024,
+                     1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.9),
+                     1000 * percentile(latencies, 0.99), 1000 * (latencies[-1] if latencies else 0), len(latencies))
+
+
+# one simulated player: the same message handling as the headless client, but on a shared event loop
+class SimulatedPlayer:
+    def __init__(self, server_address, server_port, name, stats, binary=False, turn_chance=TURN_CHANCE):
+        self.connection = AsyncConnection(server_address, server_port, binary)
+        self.name = name
+        self.stats = stats
+        self.turn_chance = turn_chance
+        self.player_key = None
+        self.game_state = GameState()
+        self.inputs = InputQueue()
+        # direction sent to the server and when, until a state shows it applied
+        self.sent_input = None
+
+    async def connect(self):
+        self.player_key = await self.connection.connect()
+        self.stats.connections.append(self.connection)
+
+    async def play(self):
+        while True:
+            msg_type, data = await self.connection.check_for_message()
+            self.stats.add_message(msg_type in (Message.SESSION_STATE_UPDATE, Message.SESSION_STATE_DELTA))
+
+            if msg_type == Message.SESSION_STATE_UPDATE:
+                self.game_state.load(data)
+                self.update()
+            elif msg_type == Message.SESSION_STATE_DELTA and not self.game_state.awaiting_keyframe:
+                if self.game_state.apply_delta(data):
+                    self.update()
+                else:
+                    self.connection.request_resync(self.game_state.tick)
+            elif msg_type == Message.SESSION_END:
+                return data["leaderboard"]
+
+    def update(self):
+        player = self.game_state.players.get(self.player_key)
+        if player is None:
+            return
+
+        direction = Direction(player["direction"])
+        if self.sent_input is not None and self.sent_input[0] == direction:
+            self.stats.add_latency(time.perf_counter() - self.sent_input[1])
+            self.sent_input = None
+
+        self.inputs.on_state(direction)
+        if random.random() < self.turn_chance:
+            self.inputs.push(random.choice(list(Direction)))
+
+        new_direction = self.inputs.pop()
+        if new_direction is not None:
+            self.connection.send_input(new_direction)
+            self.sent_input = (new_direction, time.perf_counter())
+
+
+async def run_session(server_address, server_port, index, players, stats, binary, turn_chance):
+    clients = [SimulatedPlayer(server_address, server_port, "Bot%d-%d" % (index, i), stats, binary, turn_chance)
+               for i in range(players)]
+    host = clients[0]
+
+    await host.connect()
+    await host.connection.create_session(host.name)
+    code = host.connection.session_code
+
+    for client in clients[1:]:
+        await client.connect()
+        await client.connection.join_session(client.name, code)
+
+    await host.connection.start_session(host.name, code)
+    logging.debug("Session %s started with %d players", code, players)
+
+    await asyncio.gather(*(client.play() for client in clients))
+
+
+async def report(stats, interval):
+    while True:
+        await asyncio.sleep(interval)
+        stats.report()
+
+
+async def run(server_address, server_port, sessions, players, binary=False, turn_chance=TURN_CHANCE,
+              ramp=SESSION_RAMP, report_interval=REPORT_INTERVAL):
+    stats = LoadStats()
+    reporter = asyncio.create_task(report(stats, report_interval))
+
+    tasks = []
+    for index in range(sessions):
+        tasks.append(asyncio.create_task(run_session(server_address, server_port, index, players, stats, binary,
+                                                     turn_chance)))
+        await asyncio.sleep(ramp)
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    reporter.cancel()
+
+    for index, result in enumerate(results):
+        if isinstance(result, Exception):
+            logging.error("Session %d failed: %r", index, result)
+
+    stats.report_total()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snake Multiplayer load generator")
+    parser.add_argument("server_address", help="IP address of the game server")
+    parser.add_argument("--port", type=int, default=8888, help="port of the game server (default: %(default)s)")
+    parser.add_argument("--sessions", type=int, default=10, help="sessions to play at once (default: %(default)s)")
+    parser.add_argument("--players", type=int, default=4, help="players in every session (default: %(default)s)")
+    parser.add_argument("--binary", action="store_true", help="offer the compact binary protocol")
+    parser.add_argument("--turn-chance", type=float, default=TURN_CHANCE,
+                        help="chance of a player turning on every state (default: %(default)s)")
+    parser.add_argument("--ramp", type=float, default=SESSION_RAMP,
+                        help="seconds between starting two sessions (default: %(default)s)")
+    parser.add_argument("--report-interval", type=float, default=REPORT_INTERVAL,
+                        help="seconds between two reports (default: %(default)s)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+    asyncio.run(run(args.server_address, args.port, args.sessions, args.players, args.binary, args.turn_chance,
+                    args.ramp, args.report_interval))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,68 @@
-import sys
+import argparse
 import logging
-from game import Game
+from headless import HeadlessClient
+from constans import FRAME_RATE
+from interpolation import INTERPOLATION_DELAY
 
 logging.basicConfig(format='%(asctime)s - %(message)s', datefmt='%d-%b-%y %H:%M:%S')
 
 
 def main():
-    if len(sys.argv) < 2:
+    parser = argparse.ArgumentParser(description="Snake Multiplayer client")
+    parser.add_argument("server_address", nargs="?", help="IP address of the game server")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="repaint only the cells that changed between server states")
+    transport = parser.add_mutually_exclusive_group()
+    transport.add_argument("--threaded", action="store_true",
+                           help="do all network I/O on background threads")
+    transport.add_argument("--asyncio", action="store_true",
+                           help="run the lobby and the game from an asyncio event loop")
+    parser.add_argument("--binary", action="store_true",
+                        help="offer the compact binary protocol, JSON is used if the server declines")
+    parser.add_argument("--fps", type=int, default=FRAME_RATE,
+                        help="frame rate cap, the game sleeps between frames (default: %(default)s)")
+    parser.add_argument("--interpolate", type=float, nargs="?", const=INTERPOLATION_DELAY, metavar="DELAY",
+                        help="draw snakes moving smoothly between server states, DELAY seconds behind them "
+                             "(default: %(const)s)")
+    parser.add_argument("--predict", action="store_true",
+                        help="turn the local snake right away instead of waiting for the server")
+    parser.add_argument("--stats", action="store_true",
+                        help="log frame times and the share of time spent sleeping")
+
+    headless = parser.add_argument_group("headless mode")
+    headless.add_argument("--headless", action="store_true",
+                          help="play without a window, with the menu choices given below and random turns")
+    headless.add_argument("--name", default="Bot", help="player name (default: %(default)s)")
+    headless.add_argument("--join", metavar="CODE",
+                          help="join the session with this code, otherwise a new one is created and its code printed")
+    headless.add_argument("--start-players", type=int, default=1, metavar="N",
+                          help="as host, start once N players are in the lobby (default: %(default)s)")
+    headless.add_argument("--start-after", type=float, metavar="SECONDS",
+                          help="as host, start after SECONDS even if fewer players joined")
+    args = parser.parse_args()
+
+    if args.stats:
+        logging.getLogger().setLevel(logging.INFO)
+
+    if args.server_address is None:
         logging.error("Server IP not specified!")
         exit(-1)
 
-    game = Game(sys.argv[1])
+    if args.headless:
+        client = HeadlessClient(args.server_address, args.name, binary=args.binary)
+        leaderboard = client.run(args.join, args.start_players, args.start_after)
+        for rank, players in enumerate(leaderboard, start=1):
+            for player in players:
+                print(rank, player["name"], len(player["chunks"]))
+
+        return
+
+    # imported only here, so headless clients do not load pygame and pygame_menu
+    from game import Game
+
+    game = Game(args.server_address, dirty_rects=args.dirty_rects, threaded=args.threaded,
+                use_asyncio=args.asyncio, binary=args.binary, frame_rate=args.fps,
+                interpolation_delay=args.interpolate, prediction=args.predict)
     game.show_menu()
 
 
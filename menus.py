@@ -0,0 +1,39 @@
+import pygame_menu
+from pygame_menu import Theme
+
+from constans import *
+
+_themes = {}
+_background = None
+
+
+def get_background():
+    # decoded once, every menu theme draws the same image
+    global _background
+    if _background is None:
+        _background = pygame_menu.baseimage.BaseImage(
+            image_path="img/background.jpg",
+            drawing_mode=pygame_menu.baseimage.IMAGE_MODE_REPEAT_XY
+        )
+
+    return _background
+
+
+def get_theme(font_size, margin=(0, 30)):
+    key = (font_size, tuple(margin))
+    theme = _themes.get(key)
+    if theme is None:
+        font = pygame_menu.font.FONT_OPEN_SANS_BOLD
+        theme = Theme(title_font=font, widget_font=font, widget_font_size=font_size, widget_margin=margin,
+                      title_font_color=WHITE, widget_font_color=WHITE,
+                      title_background_color=GREEN,
+                      selection_color=WHITE,
+                      focus_background_color=GREEN,
+                      background_color=get_background())
+        _themes[key] = theme
+
+    return theme
+
+
+def create_menu(title, font_size, margin=(0, 30)):
+    return pygame_menu.Menu(title, 800, 600, theme=get_theme(font_size, margin))
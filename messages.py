@@ -7,6 +7,10 @@ class Message(Enum):
     JOIN_SESSION = "join_session"
     START_SESSION = "start_session"
     INPUT = "input"
+    RESYNC = "resync"
+
+    # sent by both sides when negotiating the wire format
+    PROTOCOL = "protocol"
 
     # messages receive from server
     SESSION_JOIN = "session_join"
@@ -14,4 +18,5 @@ class Message(Enum):
     SESSION_START = "session_start"
     SESSION_END = "session_end"
     SESSION_STATE_UPDATE = "session_state_update"
+    SESSION_STATE_DELTA = "session_state_delta"
     INVALID_SESSION = "invalid_session"
@@ -3,8 +3,8 @@ from constans import *
 
 
 class Player:
-    def __init__(self, name, key=None):
-        self.snake = Snake(WIDTH / 2, HEIGHT / 2)
+    def __init__(self, name, key=None, color=GREEN):
+        self.snake = Snake(WIDTH / 2, HEIGHT / 2, color)
         self.name = name
         # self.connection = Connection(key)
         self.key = key
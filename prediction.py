@@ -0,0 +1,73 @@
+import time
+from collections import deque
+
+from constans import SEGMENT_SIZE
+from direction import OFFSETS
+
+# states after which an input the server never confirmed is treated as rejected
+INPUT_TIMEOUT = 3
+# starting guess for the time between two server states, refined as they arrive
+TICK_INTERVAL = 1 / 15
+
+
+# predicts the local snake from inputs the server has not answered yet: turns are shown right away
+# by moving the head towards the next cell, and dropped once a server state confirms or rejects them
+class Predictor:
+    def __init__(self):
+        self.sequence = 0
+        self.pending = deque()
+        self.direction = None
+        self.last_state = None
+        self.tick_interval = TICK_INTERVAL
+
+    def reset(self):
+        self.pending.clear()
+        self.direction = None
+        self.last_state = None
+
+    def add_input(self, direction):
+        self.sequence += 1
+        # [sequence, direction, states received since it was sent]
+        self.pending.append([self.sequence, direction, 0])
+        self.direction = direction
+
+        return self.sequence
+
+    def reconcile(self, server_direction, last_input=None):
+        now = time.perf_counter()
+        if self.last_state is not None:
+            self.tick_interval += (now - self.last_state - self.tick_interval) / 8
+        self.last_state = now
+
+        if last_input is not None:
+            # the server reports the last input it applied
+            while self.pending and self.pending[0][0] <= last_input:
+                self.pending.popleft()
+        else:
+            # servers without acknowledgements: an input counts as applied once the server moves that way
+            for i, (_, direction, _) in enumerate(self.pending):
+                if direction == server_direction:
+                    for _ in range(i + 1):
+                        self.pending.popleft()
+                    break
+
+        for pending_input in self.pending:
+            pending_input[2] += 1
+
+        while self.pending and self.pending[0][2] > INPUT_TIMEOUT:
+            self.pending.popleft()
+
+        self.direction = self.pending[-1][1] if self.pending else server_direction
+
+    def blit_sequence(self, snake):
+        sequence = snake.blit_sequence()
+        if not sequence or self.last_state is None or self.direction is None:
+            return sequence
+
+        progress = min((time.perf_counter() - self.last_state) / self.tick_interval, 1)
+        offset = OFFSETS[self.direction]
+        head = snake.head.position
+        sequence[-1] = (snake.head_tile, (round(head[0] + offset[0] * SEGMENT_SIZE * progress),
+                                          round(head[1] + offset[1] * SEGMENT_SIZE * progress)))
+
+        return sequence
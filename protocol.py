@@ -0,0 +1,218 @@
+import sys
+import json
+import struct
+from array import array
+
+from messages import Message
+
+JSON = "json"
+BINARY = "binary"
+
+# wire formats offered by the client, most preferred first
+PROTOCOLS = [BINARY, JSON]
+
+OPCODES = {
+    Message.CREATE_SESSION: 1,
+    Message.JOIN_SESSION: 2,
+    Message.START_SESSION: 3,
+    Message.INPUT: 4,
+    Message.PROTOCOL: 5,
+    Message.RESYNC: 6,
+    Message.SESSION_JOIN: 16,
+    Message.SESSION_LEAVE: 17,
+    Message.SESSION_START: 18,
+    Message.SESSION_END: 19,
+    Message.SESSION_STATE_UPDATE: 20,
+    Message.INVALID_SESSION: 21,
+    Message.SESSION_STATE_DELTA: 22,
+}
+MESSAGE_TYPES = {opcode: msg_type for msg_type, opcode in OPCODES.items()}
+
+# every frame is a big-endian length followed by that many bytes: one opcode byte and the payload
+FRAME_LENGTH = struct.Struct("!I")
+# coordinate typecode ("B" or "H"), apple count, player count
+STATE_HEADER = struct.Struct("<cHH")
+# key and name lengths, followed by the UTF-8 bytes of both
+PLAYER_NAMES = struct.Struct("<BB")
+# direction, chunk count, followed by the chunk coordinates
+PLAYER_BODY = struct.Struct("<BH")
+# length of a JSON object with any other fields of the state, and of every player (e.g. "last_input")
+STATE_EXTRA = struct.Struct("<H")
+
+STATE_FIELDS = ("apples", "alive_players")
+PLAYER_FIELDS = ("key", "name", "direction", "chunks")
+
+
+class Chunks:
+    # read-only sequence of (x, y) cells over a flat x0, y0, x1, y1, ... view of the frame
+    __slots__ = ("cells",)
+
+    def __init__(self, cells):
+        self.cells = cells
+
+    def __len__(self):
+        return len(self.cells) // 2
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError("chunk index out of range")
+
+        return self.cells[2 * index], self.cells[2 * index + 1]
+
+    def __iter__(self):
+        return zip(self.cells[::2], self.cells[1::2])
+
+    def tolist(self):
+        return [[x, y] for x, y in self]
+
+
+def choose_protocol(offered, binary=True):
+    # the first offered format this side supports, JSON is understood by every client
+    supported = [BINARY, JSON] if binary else [JSON]
+
+    return next((name for name in offered if name in supported), JSON)
+
+
+def encode_json(msg_type, data):
+    # the JSON wire format: one compact object per line
+    msg = json.dumps({"type": msg_type.value, "data": data}, separators=(",", ":"))
+
+    return f"{msg}\n".encode()
+
+
+def encode_frame(msg_type, data):
+    if msg_type == Message.SESSION_STATE_UPDATE:
+        payload = encode_state(data)
+    else:
+        payload = json.dumps(data, separators=(",", ":")).encode()
+
+    return FRAME_LENGTH.pack(len(payload) + 1) + bytes((OPCODES[msg_type],)) + payload
+
+
+def encode_state(data):
+    apples = data["apples"]
+    players = data["alive_players"]
+
+    largest = max((max(cell) for player in players for cell in player["chunks"]), default=0)
+    largest = max([largest] + [max(apple) for apple in apples])
+    typecode = "B" if largest < 256 else "H"
+
+    parts = [STATE_HEADER.pack(typecode.encode(), len(apples), len(players)), pack_cells(apples, typecode)]
+    for player in players:
+        key = player["key"].encode()
+        name = player["name"].encode()
+        parts.append(PLAYER_NAMES.pack(len(key), len(name)))
+        parts.append(key)
+        parts.append(name)
+        parts.append(PLAYER_BODY.pack(player["direction"], len(player["chunks"])))
+        parts.append(pack_cells(player["chunks"], typecode))
+        parts.append(pack_extra(player, PLAYER_FIELDS))
+
+    parts.append(pack_extra(data, STATE_FIELDS))
+
+    return b"".join(parts)
+
+
+def pack_extra(data, fields):
+    extra = {field: value for field, value in data.items() if field not in fields}
+    extra = json.dumps(extra, separators=(",", ":")).encode() if extra else b""
+
+    return STATE_EXTRA.pack(len(extra)) + extra
+
+
+def pack_cells(cells, typecode):
+    packed = array(typecode, [coordinate for cell in cells for coordinate in cell])
+    if sys.byteorder == "big":
+        packed.byteswap()
+
+    return packed.tobytes()
+
+
+def frames_end(buffer, first_only=False):
+    # offset just past the last (or the first) complete frame in the buffer, 0 if there is none
+    end = 0
+    while len(buffer) - end >= FRAME_LENGTH.size:
+        length = FRAME_LENGTH.unpack_from(buffer, end)[0]
+        if len(buffer) - end - FRAME_LENGTH.size < length:
+            break
+
+        end += FRAME_LENGTH.size + length
+        if first_only:
+            break
+
+    return end
+
+
+def decode_frames(data):
+    # data has to hold complete frames only and must not change while the messages are in use
+    view = memoryview(data)
+    messages = []
+    offset = 0
+
+    while offset < len(view):
+        length = FRAME_LENGTH.unpack_from(view, offset)[0]
+        offset += FRAME_LENGTH.size
+        messages.append(decode_body(view[offset:offset + length]))
+        offset += length
+
+    return messages
+
+
+def decode_body(body):
+    msg_type = MESSAGE_TYPES[body[0]]
+    if msg_type == Message.SESSION_STATE_UPDATE:
+        data = decode_state(body[1:])
+    else:
+        data = json.loads(bytes(body[1:]))
+
+    return {"type": msg_type.value, "data": data}
+
+
+def decode_state(payload):
+    typecode, apple_count, player_count = STATE_HEADER.unpack_from(payload)
+    typecode = typecode.decode()
+    offset = STATE_HEADER.size
+
+    apples, offset = unpack_cells(payload, offset, apple_count, typecode)
+    players = []
+    for _ in range(player_count):
+        key_length, name_length = PLAYER_NAMES.unpack_from(payload, offset)
+        offset += PLAYER_NAMES.size
+        key = str(payload[offset:offset + key_length], "utf-8")
+        offset += key_length
+        name = str(payload[offset:offset + name_length], "utf-8")
+        offset += name_length
+
+        direction, chunk_count = PLAYER_BODY.unpack_from(payload, offset)
+        chunks, offset = unpack_cells(payload, offset + PLAYER_BODY.size, chunk_count, typecode)
+        player = {"key": key, "name": name, "direction": direction, "chunks": chunks}
+        offset = unpack_extra(payload, offset, player)
+        players.append(player)
+
+    data = {"apples": apples, "alive_players": players}
+    unpack_extra(payload, offset, data)
+
+    return data
+
+
+def unpack_extra(payload, offset, data):
+    length = STATE_EXTRA.unpack_from(payload, offset)[0]
+    offset += STATE_EXTRA.size
+    if length:
+        data.update(json.loads(bytes(payload[offset:offset + length])))
+
+    return offset + length
+
+
+def unpack_cells(payload, offset, count, typecode):
+    end = offset + 2 * count * array(typecode).itemsize
+    cells = payload[offset:end].cast(typecode)
+    if typecode != "B" and sys.byteorder == "big":
+        swapped = array(typecode, cells)
+        swapped.byteswap()
+        cells = memoryview(swapped)
+
+    return Chunks(cells), end
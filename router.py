@@ -0,0 +1,131 @@
+import json
+import socket
+import string
+import asyncio
+import logging
+
+import protocol
+from messages import Message
+
+# the first character of a session code names the worker process that owns the session
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+MAX_WORKERS = len(CODE_ALPHABET)
+# largest hand-off message: a JSON header line followed by the bytes read from the client so far
+MAX_HANDOFF = 1 << 16
+# seconds a new client has to say which session it wants before it is dropped
+ROUTING_TIMEOUT = 10
+
+
+def worker_prefix(index):
+    return CODE_ALPHABET[index]
+
+
+def worker_for_code(code, workers):
+    index = CODE_ALPHABET.find(code[:1]) if isinstance(code, str) else -1
+
+    return index if 0 <= index < workers else None
+
+
+def first_message(buffer, wire_protocol):
+    # the first complete message in the buffer and the offset just past it, (None, 0) if there is none yet
+    if wire_protocol == protocol.BINARY:
+        end = protocol.frames_end(buffer, first_only=True)
+        if not end:
+            return None, 0
+
+        return protocol.decode_body(memoryview(bytes(buffer[protocol.FRAME_LENGTH.size:end]))), end
+
+    end = buffer.find(b"\n")
+    if end < 0:
+        return None, 0
+
+    return json.loads(buffer[:end]), end + 1
+
+
+def send_handoff(channel, sock, wire_protocol, buffered):
+    header = json.dumps({"protocol": wire_protocol}).encode()
+    socket.send_fds(channel, [header + b"\n" + bytes(buffered)], [sock.fileno()])
+
+
+def receive_handoff(channel):
+    # (socket, wire format, bytes already read from it), or None once the router is gone
+    msg, fds, _, _ = socket.recv_fds(channel, MAX_HANDOFF, 1)
+    if not fds:
+        return None
+
+    header, _, buffered = msg.partition(b"\n")
+
+    return socket.socket(fileno=fds[0]), json.loads(header)["protocol"], buffered
+
+
+# front acceptor of a sharded server: it reads each client up to its first create_session or join_session
+# and passes the socket, with everything read from it, to the worker process owning that session;
+# new sessions go to the workers in turn, and joins go to the worker named by the session code
+class Router:
+    def __init__(self, channels, binary=True):
+        self.channels = channels
+        self.binary = binary
+        self.next_worker = 0
+        # clients being routed, held here because the event loop only keeps weak references to its tasks
+        self.tasks = set()
+
+    async def serve(self, host, port):
+        loop = asyncio.get_running_loop()
+        listener = socket.create_server((host, port))
+        listener.setblocking(False)
+        logging.info("Routing %s to %d workers", listener.getsockname(), len(self.channels))
+
+        with listener:
+            while True:
+                sock, _ = await loop.sock_accept(listener)
+                task = asyncio.create_task(self.route(sock))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def route(self, sock):
+        loop = asyncio.get_running_loop()
+        buffer = bytearray()
+        wire_protocol = protocol.JSON
+
+        try:
+            while True:
+                msg, end = first_message(buffer, wire_protocol)
+                if msg is None:
+                    if len(buffer) >= MAX_HANDOFF // 2:
+                        raise ValueError("no session request in the first %d bytes" % len(buffer))
+
+                    data = await asyncio.wait_for(loop.sock_recv(sock, MAX_HANDOFF // 2), ROUTING_TIMEOUT)
+                    if not data:
+                        sock.close()
+                        return
+
+                    buffer += data
+                    continue
+
+                msg_type = Message(msg["type"])
+                if msg_type == Message.PROTOCOL:
+                    # negotiated here, the worker gets the result along with the socket
+                    del buffer[:end]
+                    wire_protocol = protocol.choose_protocol(msg["data"]["protocols"], self.binary)
+                    await loop.sock_sendall(sock, protocol.encode_json(Message.PROTOCOL, {"protocol": wire_protocol}))
+                    continue
+
+                worker = self.choose_worker(msg_type, msg["data"])
+                send_handoff(self.channels[worker], sock, wire_protocol, buffer)
+                sock.close()
+                return
+        except (OSError, asyncio.TimeoutError, ValueError, KeyError, TypeError) as error:
+            logging.warning("Dropping an unrouted client: %r", error)
+            sock.close()
+
+    def choose_worker(self, msg_type, data):
+        if msg_type == Message.JOIN_SESSION:
+            worker = worker_for_code(data["code"], len(self.channels))
+            if worker is not None:
+                return worker
+
+        # new sessions, and joins with a code no worker owns (the worker answers those as invalid)
+        worker = self.next_worker
+        self.next_worker = (self.next_worker + 1) % len(self.channels)
+
+        return worker
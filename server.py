@@ -0,0 +1,425 @@
+import json
+import time
+import random
+import string
+import socket
+import asyncio
+import logging
+import argparse
+import multiprocessing
+
+import protocol
+import router
+from direction import Direction
+from messages import Message
+from simulation import Simulation, COLUMNS, ROWS, APPLE_COUNT
+
+TICK_RATE = 15
+MAX_SESSIONS = 1000
+CODE_LENGTH = 5
+# the client's nickname field allows this many characters, longer names are cut
+MAX_NAME_LENGTH = 10
+# a client whose unsent data grows past this many bytes does not keep up with the states and is dropped
+MAX_WRITE_BUFFER = 1 << 20
+
+logging.basicConfig(format='%(asctime)s - %(message)s', datefmt='%d-%b-%y %H:%M:%S')
+
+
+def player_name(name):
+    if not isinstance(name, str):
+        raise TypeError("player name has to be a string, not %r" % name)
+
+    return name[:MAX_NAME_LENGTH]
+
+
+def encode_message(wire_protocol, msg_type, data):
+    if wire_protocol == protocol.BINARY:
+        return protocol.encode_frame(msg_type, data)
+    else:
+        return protocol.encode_json(msg_type, data)
+
+
+class Client:
+    def __init__(self, reader, writer, wire_protocol=protocol.JSON):
+        self.reader = reader
+        self.writer = writer
+        peername = writer.get_extra_info("peername")
+        # the same key the client builds from its own address
+        self.key = str(peername[0]) + ":" + str(peername[1])
+        self.name = None
+        self.session = None
+        self.protocol = wire_protocol
+        self.needs_keyframe = True
+
+    async def receive_message(self):
+        if self.protocol == protocol.BINARY:
+            try:
+                header = await self.reader.readexactly(protocol.FRAME_LENGTH.size)
+                body = await self.reader.readexactly(protocol.FRAME_LENGTH.unpack(header)[0])
+            except asyncio.IncompleteReadError:
+                return None
+
+            return protocol.decode_body(memoryview(body))
+
+        line = await self.reader.readline()
+        if not line:
+            return None
+
+        return json.loads(line)
+
+    def send_message(self, msg_type, data):
+        self.write(encode_message(self.protocol, msg_type, data))
+
+    def write(self, data):
+        if self.writer.is_closing():
+            return
+
+        self.writer.write(data)
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            logging.warning("Dropping %s, it does not read its messages", self.key)
+            # the reader sees the end of the stream, so the client is cleaned up by its handler
+            self.writer.transport.abort()
+
+
+class Session:
+    def __init__(self, code, owner):
+        self.code = code
+        self.owner = owner
+        self.members = [owner]
+        self.simulation = None
+        self.task = None
+        # broadcast metrics of the states sent so far
+        self.ticks = 0
+        self.encode_time = 0
+        self.slowest_encode = 0
+        self.bytes_sent = 0
+
+    def join_data(self, player):
+        return {"code": self.code, "player": {"name": player.name, "key": player.key},
+                "players": [{"name": member.name, "key": member.key} for member in self.members],
+                "owner_key": self.owner.key}
+
+    def broadcast(self, msg_type, data):
+        # encoded once per wire format in use, every member with that format is sent the same bytes
+        encoded = {}
+        for member in self.members:
+            if member.protocol not in encoded:
+                encoded[member.protocol] = encode_message(member.protocol, msg_type, data)
+            member.write(encoded[member.protocol])
+
+    def add_tick(self, encode_time, bytes_sent):
+        self.ticks += 1
+        self.encode_time += encode_time
+        self.slowest_encode = max(self.slowest_encode, encode_time)
+        self.bytes_sent += bytes_sent
+        logging.debug("Session %s tick %d: encoded in %.3f ms, %d bytes fanned out",
+                      self.code, self.ticks, 1000 * encode_time, bytes_sent)
+
+    def report(self):
+        ticks = max(self.ticks, 1)
+        logging.info("Session %s ended after %d ticks: state encoding avg %.3f ms / max %.3f ms, "
+                     "%.1f KB fanned out per tick", self.code, self.simulation.tick, 1000 * self.encode_time / ticks,
+                     1000 * self.slowest_encode, self.bytes_sent / ticks / 1024)
+
+
+# reference server for local benchmarks and tests: it speaks the same protocol as the game server
+# and plays its sessions in one process, one asyncio task per running session
+#
+# a sharded server runs one of these per worker process behind a router.Router, which hands the
+# clients over; the worker's code prefix makes the codes of its sessions lead back to it
+class Server:
+    def __init__(self, tick_rate=TICK_RATE, columns=COLUMNS, rows=ROWS, apple_count=APPLE_COUNT,
+                 max_sessions=MAX_SESSIONS, keyframe_interval=1, binary=True, code_prefix=""):
+        self.tick_rate = tick_rate
+        self.columns = columns
+        self.rows = rows
+        self.apple_count = apple_count
+        self.max_sessions = max_sessions
+        # ticks between two full states, the ones in between are sent as deltas
+        self.keyframe_interval = keyframe_interval
+        self.binary = binary
+        self.code_prefix = code_prefix
+        self.sessions = {}
+        # hand-offs being adopted, referenced until they finish so they cannot be garbage collected
+        self.tasks = set()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        logging.info("Listening on %s", ", ".join(str(sock.getsockname()) for sock in server.sockets))
+
+        async with server:
+            await server.serve_forever()
+
+    async def serve_handoffs(self, channel):
+        loop = asyncio.get_running_loop()
+        closed = loop.create_future()
+        channel.setblocking(False)
+        loop.add_reader(channel.fileno(), self.accept_handoff, channel, closed)
+
+        await closed
+        loop.remove_reader(channel.fileno())
+
+    def accept_handoff(self, channel, closed):
+        try:
+            handoff = router.receive_handoff(channel)
+        except BlockingIOError:
+            return
+
+        if handoff is None:
+            if not closed.done():
+                closed.set_result(None)
+            return
+
+        task = asyncio.create_task(self.adopt_client(*handoff))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def adopt_client(self, sock, wire_protocol, buffered):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        # what the router read already comes first, the rest is read from the socket
+        reader.feed_data(buffered)
+        transport, stream_protocol = await loop.connect_accepted_socket(
+            lambda: asyncio.StreamReaderProtocol(reader), sock)
+        writer = asyncio.StreamWriter(transport, stream_protocol, reader, loop)
+
+        await self.handle_client(reader, writer, wire_protocol)
+
+    async def handle_client(self, reader, writer, wire_protocol=protocol.JSON):
+        client = Client(reader, writer, wire_protocol)
+        try:
+            while True:
+                msg = await client.receive_message()
+                if msg is None:
+                    break
+
+                self.handle_message(client, Message(msg["type"]), msg["data"])
+        except (ConnectionError, ValueError, KeyError, TypeError) as error:
+            logging.warning("Dropping %s: %r", client.key, error)
+        finally:
+            self.leave_session(client)
+            writer.close()
+
+    def handle_message(self, client, msg_type, data):
+        if msg_type == Message.PROTOCOL:
+            self.negotiate_protocol(client, data["protocols"])
+        elif msg_type == Message.CREATE_SESSION:
+            self.create_session(client, data["player_name"])
+        elif msg_type == Message.JOIN_SESSION:
+            self.join_session(client, data["code"], data["player_name"])
+        elif msg_type == Message.START_SESSION:
+            self.start_session(client, data["code"])
+        elif msg_type == Message.INPUT:
+            session = client.session
+            if session is not None and session.simulation is not None:
+                session.simulation.turn(client.key, Direction(data["new_direction"]), data.get("sequence"))
+        elif msg_type == Message.RESYNC:
+            client.needs_keyframe = True
+        else:
+            logging.warning("Unexpected %s message from %s", msg_type.value, client.key)
+
+    def negotiate_protocol(self, client, protocols):
+        chosen = protocol.choose_protocol(protocols, self.binary)
+
+        # the answer is always a JSON line, the chosen format is used from the next message on
+        client.writer.write(protocol.encode_json(Message.PROTOCOL, {"protocol": chosen}))
+        client.protocol = chosen
+
+    def create_session(self, client, name):
+        self.leave_session(client)
+        if len(self.sessions) >= self.max_sessions:
+            logging.warning("Refusing a new session from %s, %d sessions are open", client.key, len(self.sessions))
+            client.send_message(Message.INVALID_SESSION, {})
+            return
+
+        code = self.new_code()
+        client.name = player_name(name)
+        client.session = self.sessions[code] = Session(code, client)
+        client.send_message(Message.SESSION_JOIN, client.session.join_data(client))
+        logging.info("%s created session %s", client.key, code)
+
+    def new_code(self):
+        while True:
+            code = self.code_prefix + "".join(random.choices(string.ascii_uppercase + string.digits,
+                                                             k=CODE_LENGTH - len(self.code_prefix)))
+            if code not in self.sessions:
+                return code
+
+    def join_session(self, client, code, name):
+        self.leave_session(client)
+        session = self.sessions.get(code)
+        if session is None or session.simulation is not None:
+            client.send_message(Message.INVALID_SESSION, {"code": code})
+            return
+
+        client.name = player_name(name)
+        client.session = session
+        session.members.append(client)
+        # the joining player reads this broadcast as the answer to its request
+        session.broadcast(Message.SESSION_JOIN, session.join_data(client))
+
+    def start_session(self, client, code):
+        session = client.session
+        if session is None or session.code != code or session.owner is not client or session.simulation is not None:
+            logging.warning("%s cannot start session %s", client.key, code)
+            return
+
+        session.broadcast(Message.SESSION_START, {})
+        session.simulation = Simulation([(member.key, member.name) for member in session.members],
+                                        self.columns, self.rows, self.apple_count)
+        session.task = asyncio.create_task(self.run_session(session))
+        logging.info("Session %s started with %d players", code, len(session.members))
+
+    def leave_session(self, client):
+        session = client.session
+        if session is None:
+            return
+
+        client.session = None
+        session.members.remove(client)
+        if session.simulation is not None:
+            session.simulation.remove(client.key)
+
+        if not session.members:
+            if session.task is not None:
+                session.task.cancel()
+            self.close_session(session)
+            return
+
+        if session.owner is client:
+            session.owner = session.members[0]
+
+        if session.simulation is None:
+            session.broadcast(Message.SESSION_LEAVE, {"key": client.key, "owner_key": session.owner.key})
+
+    def close_session(self, session):
+        if self.sessions.get(session.code) is session:
+            del self.sessions[session.code]
+
+        for member in session.members:
+            member.session = None
+
+    async def run_session(self, session):
+        try:
+            await self.play_session(session)
+        except Exception:
+            # the members are still told the session is over, and it is not left behind in self.sessions
+            logging.exception("Session %s stopped by an error", session.code)
+
+        session.broadcast(Message.SESSION_END, {"leaderboard": session.simulation.leaderboard()})
+        session.report()
+        self.close_session(session)
+
+    async def play_session(self, session):
+        loop = asyncio.get_running_loop()
+        simulation = session.simulation
+        interval = 1 / self.tick_rate
+        next_tick = loop.time()
+
+        self.send_state(session)
+        while not simulation.finished():
+            next_tick += interval
+            delay = next_tick - loop.time()
+            if delay < -interval:
+                logging.warning("Session %s is %.1f ms behind its tick rate", session.code, -1000 * delay)
+                next_tick = loop.time()
+
+            await asyncio.sleep(max(0, delay))
+            simulation.step()
+            self.send_state(session)
+
+    def send_state(self, session):
+        # the state and the delta are each built once and encoded once per wire format,
+        # then the same immutable bytes are written to every member's transport
+        simulation = session.simulation
+        keyframe = self.keyframe_interval <= 1 or simulation.tick % self.keyframe_interval == 0
+        data = {}
+        frames = {}
+        encode_time = 0
+        bytes_sent = 0
+
+        for member in session.members:
+            if keyframe or member.needs_keyframe:
+                msg_type = Message.SESSION_STATE_UPDATE
+            else:
+                msg_type = Message.SESSION_STATE_DELTA
+
+            frame = frames.get((msg_type, member.protocol))
+            if frame is None:
+                started = time.perf_counter()
+                if msg_type not in data:
+                    data[msg_type] = self.state_data(simulation, msg_type)
+
+                frame = encode_message(member.protocol, msg_type, data[msg_type])
+                frames[(msg_type, member.protocol)] = frame
+                encode_time += time.perf_counter() - started
+
+            member.write(frame)
+            member.needs_keyframe = False
+            bytes_sent += len(frame)
+
+        session.add_tick(encode_time, bytes_sent)
+
+    @staticmethod
+    def state_data(simulation, msg_type):
+        if msg_type == Message.SESSION_STATE_UPDATE:
+            return simulation.state()
+        else:
+            return simulation.delta(simulation.tick - 1)
+
+
+def run_worker(index, channel, options):
+    server = Server(code_prefix=router.worker_prefix(index), **options)
+    try:
+        asyncio.run(server.serve_handoffs(channel))
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_sharded(host, port, workers, options):
+    # sockets are passed with SCM_RIGHTS, so this needs a Unix system
+    channels = []
+    for index in range(workers):
+        router_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        multiprocessing.Process(target=run_worker, args=(index, worker_end, options), daemon=True).start()
+        worker_end.close()
+        channels.append(router_end)
+
+    asyncio.run(router.Router(channels, options["binary"]).serve(host, port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snake Multiplayer reference server")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8888, help="port to listen on (default: %(default)s)")
+    parser.add_argument("--tick-rate", type=float, default=TICK_RATE,
+                        help="game steps per second (default: %(default)s)")
+    parser.add_argument("--columns", type=int, default=COLUMNS, help="arena width in cells (default: %(default)s)")
+    parser.add_argument("--rows", type=int, default=ROWS, help="arena height in cells (default: %(default)s)")
+    parser.add_argument("--apples", type=int, default=APPLE_COUNT,
+                        help="apples on the board at once (default: %(default)s)")
+    parser.add_argument("--max-sessions", type=int, default=MAX_SESSIONS,
+                        help="sessions open at once in every worker, lobbies included (default: %(default)s)")
+    parser.add_argument("--keyframe-interval", type=int, default=1, metavar="TICKS",
+                        help="send a full state every TICKS ticks and deltas in between (default: %(default)s)")
+    parser.add_argument("--json-only", action="store_true", help="decline the binary protocol")
+    parser.add_argument("--workers", type=int, default=1, choices=range(1, router.MAX_WORKERS + 1), metavar="N",
+                        help="worker processes sharing the sessions, the main process only routes clients "
+                             "when there is more than one (default: %(default)s)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+    options = {"tick_rate": args.tick_rate, "columns": args.columns, "rows": args.rows, "apple_count": args.apples,
+               "max_sessions": args.max_sessions, "keyframe_interval": args.keyframe_interval,
+               "binary": not args.json_only}
+    try:
+        if args.workers > 1:
+            serve_sharded(args.host, args.port, args.workers, options)
+        else:
+            asyncio.run(Server(**options).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
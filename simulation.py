@@ -0,0 +1,223 @@
+import random
+from array import array
+from collections import deque
+
+from constans import WIDTH, HEIGHT, SEGMENT_SIZE
+from direction import Direction, OFFSETS, OPPOSITES
+
+COLUMNS = WIDTH // SEGMENT_SIZE
+ROWS = HEIGHT // SEGMENT_SIZE
+START_LENGTH = 3
+APPLE_COUNT = 1
+
+
+class SnakeState:
+    def __init__(self, key, name, chunks, direction=Direction.UP):
+        self.key = key
+        self.name = name
+        # (x, y) cells, head first
+        self.chunks = deque(chunks)
+        self.direction = direction
+        self.next_direction = direction
+        self.last_input = None
+        self.alive = True
+        # cells added in front of the head (newest first) and cells trimmed off the tail by the last step
+        self.added = []
+        self.trimmed = 0
+
+    def data(self):
+        data = {"key": self.key, "name": self.name, "chunks": [list(chunk) for chunk in self.chunks],
+                "direction": self.direction.value}
+        if self.last_input is not None:
+            data["last_input"] = self.last_input
+
+        return data
+
+
+# the authoritative game: every step each snake moves one cell and grows when it eats an apple,
+# it dies on the walls and on any body, so a head-on collision kills both snakes
+#
+# bodies are tracked in an occupancy grid holding the number of snake cells on every board cell,
+# updated as heads advance and tails retract, so a step costs O(1) per snake instead of a scan of every body;
+# cells with neither a snake nor an apple are listed in a free-cell index, so apples are placed in O(1)
+class Simulation:
+    def __init__(self, players, columns=COLUMNS, rows=ROWS, apple_count=APPLE_COUNT, rng=random):
+        self.columns = columns
+        self.rows = rows
+        self.apple_count = apple_count
+        self.rng = rng
+        self.tick = 0
+        self.snakes = {}
+        self.grid = bytearray(columns * rows)
+        # cells with an apple, kept in the order they were placed
+        self.apples = {}
+        # indexes of the free cells in no particular order, and where each cell is in that list (-1 if taken)
+        self.free = array("l", range(columns * rows))
+        self.free_positions = array("l", range(columns * rows))
+        self.apples_changed = True
+        # snakes that died on the same step share a place, the last group is the first place
+        self.deaths = []
+
+        for i, (key, name) in enumerate(players):
+            x = (i + 1) * columns // (len(players) + 1)
+            y = max(0, (rows - START_LENGTH) // 2)
+            self.add_snake(key, name, [(x, y + j) for j in range(min(START_LENGTH, rows))])
+
+        self.spawn_apples()
+
+    def add_snake(self, key, name, chunks):
+        self.snakes[key] = SnakeState(key, name, chunks)
+        for cell in chunks:
+            self.occupy(cell)
+
+    def index(self, cell):
+        return cell[1] * self.columns + cell[0]
+
+    def on_board(self, cell):
+        return 0 <= cell[0] < self.columns and 0 <= cell[1] < self.rows
+
+    def occupy(self, cell):
+        index = self.index(cell)
+        self.grid[index] += 1
+        self.take_free(index)
+
+    def vacate(self, cell):
+        index = self.index(cell)
+        self.grid[index] -= 1
+        if not self.grid[index] and cell not in self.apples:
+            self.add_free(index)
+
+    def take_free(self, index):
+        # swap-remove: the last free cell fills the hole, so the list stays dense
+        position = self.free_positions[index]
+        if position < 0:
+            return
+
+        last = self.free.pop()
+        if last != index:
+            self.free[position] = last
+            self.free_positions[last] = position
+        self.free_positions[index] = -1
+
+    def add_free(self, index):
+        if self.free_positions[index] < 0:
+            self.free_positions[index] = len(self.free)
+            self.free.append(index)
+
+    def alive(self):
+        return [snake for snake in self.snakes.values() if snake.alive]
+
+    def finished(self):
+        return not any(snake.alive for snake in self.snakes.values())
+
+    def turn(self, key, direction, sequence=None):
+        snake = self.snakes.get(key)
+        if snake is None or not snake.alive:
+            return
+
+        # a reversal would run the snake into its own neck
+        if direction != OPPOSITES[snake.direction]:
+            snake.next_direction = direction
+
+        if sequence is not None:
+            snake.last_input = sequence
+
+    def remove(self, key):
+        snake = self.snakes.get(key)
+        if snake is not None and snake.alive:
+            self.kill(snake)
+            self.deaths.append([snake])
+
+    def kill(self, snake):
+        snake.alive = False
+        for cell in snake.chunks:
+            if self.on_board(cell):
+                self.vacate(cell)
+
+    def step(self):
+        self.tick += 1
+        self.apples_changed = False
+        alive = self.alive()
+
+        # every tail retracts before any head advances, so a head may enter the cell a tail has just left
+        for snake in alive:
+            snake.direction = snake.next_direction
+            offset = OFFSETS[snake.direction]
+            x, y = snake.chunks[0]
+            head = (x + offset[0], y + offset[1])
+            snake.chunks.appendleft(head)
+            snake.added = [head]
+
+            if head in self.apples:
+                snake.trimmed = 0
+            else:
+                self.vacate(snake.chunks.pop())
+                snake.trimmed = 1
+
+        for snake in alive:
+            head = snake.chunks[0]
+            if self.on_board(head):
+                self.occupy(head)
+
+        # a head shares its cell with another snake cell when it ran into a body or into another head
+        dead = [snake for snake in alive if not self.on_board(snake.chunks[0])
+                or self.grid[self.index(snake.chunks[0])] > 1]
+        for snake in dead:
+            self.kill(snake)
+
+        if dead:
+            self.deaths.append(dead)
+
+        for snake in alive:
+            head = snake.chunks[0]
+            if snake.trimmed == 0 and head in self.apples:
+                self.remove_apple(head)
+
+        self.spawn_apples()
+
+    def spawn_apples(self):
+        while len(self.apples) < self.apple_count and self.spawn_apple():
+            self.apples_changed = True
+
+    def spawn_apple(self):
+        # uniform over the free cells however full the board is
+        if not self.free:
+            return False
+
+        index = self.free[self.rng.randrange(len(self.free))]
+        self.take_free(index)
+        self.apples[(index % self.columns, index // self.columns)] = True
+
+        return True
+
+    def remove_apple(self, cell):
+        del self.apples[cell]
+        self.apples_changed = True
+
+        index = self.index(cell)
+        if not self.grid[index]:
+            self.add_free(index)
+
+    def leaderboard(self):
+        places = [self.alive()] if not self.finished() else []
+        places += reversed(self.deaths)
+
+        return [[{"name": snake.name, "chunks": [list(chunk) for chunk in snake.chunks]} for snake in place]
+                for place in places]
+
+    def state(self):
+        return {"tick": self.tick, "apples": [list(apple) for apple in self.apples],
+                "alive_players": [snake.data() for snake in self.alive()]}
+
+    def delta(self, base_tick):
+        # only valid when base_tick is the previous step, the added and trimmed cells describe that step alone
+        players = []
+        for snake in self.alive():
+            players.append({"key": snake.key, "direction": snake.direction.value,
+                            "head": [list(cell) for cell in snake.added], "trim": snake.trimmed})
+
+        data = {"tick": self.tick, "base_tick": base_tick, "players": players}
+        if self.apples_changed:
+            data["apples"] = [list(apple) for apple in self.apples]
+
+        return data
@@ -1,34 +1,75 @@
+from collections import deque
+
 import pygame
 
+import assets
 from direction import Direction
 from segment import Segment
 from constans import *
 
+# how many new head cells per update are looked for before falling back to a full rebuild
+MAX_DIFF_STEPS = 8
+
 
 class Snake (pygame.sprite.Sprite):
-    def __init__(self, x_start, y_start):
+    def __init__(self, x_start, y_start, color=GREEN):
         super().__init__()
-        self.head = self.create_head(x_start, y_start)
-        self.segments = []
-        self.segments.append(self.head)
+        self.tile = assets.get_tile(color)
+        self.head_tile = assets.get_tile(color, head=True)
+        self.segments = deque()
+        self.segments.append(Segment(x_start, y_start))
         self.direction = Direction.UP
+        # (head cells added, positions trimmed off the tail) by the last update, None after a rebuild
+        self.changes = None
 
     def update_segments(self, chunks, direction):
+        if not self.move_segments(chunks):
+            self.rebuild_segments(chunks)
+            self.changes = None
+
+        self.direction = Direction(direction)
+
+    def move_segments(self, chunks):
+        # the server moves a snake by adding cells in front of the head and trimming the tail,
+        # so only the cells in front of the old head and the tail end have to be checked
+        if not chunks or not self.segments:
+            return False
+
+        old_head = self.segments[0].position
+        for added in range(min(len(chunks), MAX_DIFF_STEPS + 1)):
+            if self.position(chunks[added]) == old_head:
+                break
+        else:
+            return False
+
+        kept = len(chunks) - added
+        if kept > len(self.segments) or self.position(chunks[-1]) != self.segments[kept - 1].position:
+            return False
+
+        trimmed = [self.segments.pop().position for _ in range(len(self.segments) - kept)]
+
+        for i in range(added - 1, -1, -1):
+            self.segments.appendleft(Segment(*self.position(chunks[i])))
+
+        self.changes = (added, trimmed)
+        return True
+
+    def rebuild_segments(self, chunks):
         self.segments.clear()
         for segment in chunks:
-            self.segments.append(Segment(segment[0] * SEGMENT_SIZE, segment[1] * SEGMENT_SIZE))
+            self.segments.append(Segment(*self.position(segment)))
 
-        self.head = self.create_head(chunks[0][0] * SEGMENT_SIZE, chunks[0][1] * SEGMENT_SIZE)
-        self.segments[0] = self.head
+    @staticmethod
+    def position(chunk):
+        return chunk[0] * SEGMENT_SIZE, chunk[1] * SEGMENT_SIZE
 
-        self.direction = Direction(direction).name
+    @property
+    def head(self):
+        return self.segments[0]
 
-    @staticmethod
-    def create_head(x, y):
-        head = Segment(x, y)
-        head.surface.blit(pygame.image.load("img/head.png"), (0, 0))
-        return head
-
-    def draw(self, screen):
-        for segment in self.segments:
-            screen.blit(segment.surface, segment.rect)
+    def blit_sequence(self):
+        sequence = [(self.tile, segment.position) for segment in self.segments]
+        if sequence:
+            sequence.append((self.head_tile, self.head.position))
+
+        return sequence
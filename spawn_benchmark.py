@@ -0,0 +1,57 @@
+import time
+import random
+import argparse
+
+from simulation import Simulation, COLUMNS, ROWS
+
+FILLS = [0, 0.5, 0.75, 0.9, 0.95, 0.99]
+SPAWNS = 20000
+
+
+def spawn_by_rejection(simulation):
+    # the previous placement: random cells are drawn until a free one comes up
+    while True:
+        cell = (simulation.rng.randrange(simulation.columns), simulation.rng.randrange(simulation.rows))
+        if not simulation.grid[simulation.index(cell)] and cell not in simulation.apples:
+            simulation.apples[cell] = True
+            simulation.take_free(simulation.index(cell))
+            return True
+
+
+def filled_board(columns, rows, fill, seed):
+    # a single snake covering the wanted share of the board, its cells do not have to be connected
+    rng = random.Random(seed)
+    simulation = Simulation([], columns, rows, apple_count=0, rng=rng)
+    cells = [(x, y) for x in range(columns) for y in range(rows)]
+    rng.shuffle(cells)
+    simulation.add_snake("filler", "Filler", cells[:int(fill * len(cells))])
+
+    return simulation
+
+
+def measure(simulation, spawn, spawns):
+    started = time.perf_counter()
+    for _ in range(spawns):
+        spawn(simulation)
+        simulation.remove_apple(next(iter(simulation.apples)))
+
+    return (time.perf_counter() - started) / spawns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apple placement cost against board fill")
+    parser.add_argument("--columns", type=int, default=COLUMNS, help="board width in cells (default: %(default)s)")
+    parser.add_argument("--rows", type=int, default=ROWS, help="board height in cells (default: %(default)s)")
+    parser.add_argument("--spawns", type=int, default=SPAWNS,
+                        help="apples placed for every fill level (default: %(default)s)")
+    args = parser.parse_args()
+
+    print("fill    rejection   free-cell index   (us per apple)")
+    for fill in FILLS:
+        rejection = measure(filled_board(args.columns, args.rows, fill, 1), spawn_by_rejection, args.spawns)
+        index = measure(filled_board(args.columns, args.rows, fill, 1), Simulation.spawn_apple, args.spawns)
+        print("%3.0f%%  %10.2f  %16.2f" % (100 * fill, 1e6 * rejection, 1e6 * index))
+
+
+if __name__ == "__main__":
+    main()
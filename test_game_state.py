@@ -0,0 +1,69 @@
+from collections import deque
+
+import protocol
+from game_state import GameState
+from messages import Message
+
+
+def keyframe(tick=1):
+    state = GameState()
+    state.load({"tick": tick, "apples": [[9, 9]], "alive_players": [
+        {"key": "a", "name": "A", "direction": 1, "chunks": [[5, 5], [5, 6], [5, 7]]}]})
+
+    return state
+
+
+def delta(base_tick, players, **fields):
+    return dict({"tick": base_tick + 1, "base_tick": base_tick, "players": players}, **fields)
+
+
+def test_gap_in_ticks_waits_for_keyframe():
+    state = keyframe(tick=1)
+
+    assert not state.apply_delta(delta(2, [{"key": "a", "direction": 1, "head": [[5, 4]], "trim": 1}]))
+    assert state.awaiting_keyframe
+    assert state.tick == 1
+
+    # later deltas are refused too, even one that follows on from the last applied tick
+    assert not state.apply_delta(delta(1, [{"key": "a", "direction": 1, "head": [[5, 4]], "trim": 1}]))
+
+    state.load({"tick": 5, "apples": [[9, 9]], "alive_players": []})
+    assert not state.awaiting_keyframe
+
+
+def test_trim_longer_than_snake_is_refused():
+    state = keyframe()
+
+    assert not state.apply_delta(delta(1, [{"key": "a", "direction": 1, "head": [], "trim": 4}]))
+    assert state.awaiting_keyframe
+    assert list(state.players["a"]["chunks"]) == [[5, 5], [5, 6], [5, 7]]
+
+
+def test_newcomer_arrives_with_full_chunks():
+    state = keyframe()
+
+    assert state.apply_delta(delta(1, [
+        {"key": "a", "direction": 3, "head": [[6, 5]], "trim": 1},
+        {"key": "b", "name": "B", "direction": 2, "chunks": [[1, 1], [1, 0]]},
+    ], apples=[[2, 2]]))
+
+    assert state.tick == 2
+    assert state.apples == [[2, 2]]
+    assert list(state.players["a"]["chunks"]) == [[6, 5], [5, 5], [5, 6]]
+    assert state.players["a"]["direction"] == 3
+    assert state.players["b"]["chunks"] == [[1, 1], [1, 0]]
+    assert [player["key"] for player in state.data()["alive_players"]] == ["a", "b"]
+
+
+def test_binary_keyframe_chunks_become_deque_on_first_delta():
+    frame = protocol.encode_frame(Message.SESSION_STATE_UPDATE, {"tick": 1, "apples": [[9, 9]], "alive_players": [
+        {"key": "a", "name": "A", "direction": 1, "chunks": [[5, 5], [5, 6], [5, 7]]}]})
+    state = GameState()
+    state.load(protocol.decode_frames(frame)[0]["data"])
+    assert isinstance(state.players["a"]["chunks"], protocol.Chunks)
+
+    assert state.apply_delta(delta(1, [{"key": "a", "direction": 1, "head": [[5, 3], [5, 4]], "trim": 2}]))
+
+    chunks = state.players["a"]["chunks"]
+    assert isinstance(chunks, deque)
+    assert [tuple(cell) for cell in chunks] == [(5, 3), (5, 4), (5, 5)]
@@ -0,0 +1,36 @@
+import protocol
+from messages import Message
+
+
+def round_trip(data):
+    frame = protocol.encode_frame(Message.SESSION_STATE_UPDATE, data)
+    msg = protocol.decode_frames(frame)[0]
+    assert msg["type"] == Message.SESSION_STATE_UPDATE.value
+
+    return msg["data"]
+
+
+def test_state_round_trip_keeps_player_extras():
+    data = {"tick": 7, "apples": [[1, 2]], "alive_players": [
+        {"key": "127.0.0.1:5000", "name": "Host", "direction": 3, "chunks": [[5, 5], [4, 5]], "last_input": 12},
+        {"key": "127.0.0.1:5001", "name": "Guest", "direction": 1, "chunks": [[300, 9]]},
+    ]}
+
+    decoded = round_trip(data)
+    players = decoded["alive_players"]
+
+    assert decoded["tick"] == 7
+    assert decoded["apples"].tolist() == [[1, 2]]
+    assert players[0]["last_input"] == 12
+    assert "last_input" not in players[1]
+    assert [player["chunks"].tolist() for player in players] == [[[5, 5], [4, 5]], [[300, 9]]]
+    assert [(player["key"], player["name"], player["direction"]) for player in players] == \
+           [("127.0.0.1:5000", "Host", 3), ("127.0.0.1:5001", "Guest", 1)]
+
+
+def test_state_round_trip_without_extras():
+    decoded = round_trip({"apples": [[0, 0]], "alive_players": [
+        {"key": "k", "name": "n", "direction": 2, "chunks": [[1, 1]]}]})
+
+    assert set(decoded) == {"apples", "alive_players"}
+    assert set(decoded["alive_players"][0]) == {"key", "name", "direction", "chunks"}
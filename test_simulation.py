@@ -0,0 +1,35 @@
+import random
+from collections import Counter
+
+from direction import Direction
+from simulation import Simulation
+
+COLUMNS = 12
+ROWS = 9
+
+
+def check_board(simulation):
+    counts = Counter(simulation.index(cell) for snake in simulation.alive() for cell in snake.chunks
+                     if simulation.on_board(cell))
+    free = {index for index in range(COLUMNS * ROWS)
+            if not counts[index] and (index % COLUMNS, index // COLUMNS) not in simulation.apples}
+
+    assert list(simulation.grid) == [counts[index] for index in range(COLUMNS * ROWS)]
+    assert set(simulation.free) == free
+    assert len(simulation.free) == len(free)
+
+
+def test_grid_and_free_cells_follow_the_snakes():
+    for seed in range(200):
+        rng = random.Random(seed)
+        players = [(str(i), "Player%d" % i) for i in range(1 + seed % 5)]
+        simulation = Simulation(players, COLUMNS, ROWS, apple_count=5, rng=random.Random(seed + 1000))
+        check_board(simulation)
+
+        while not simulation.finished():
+            for key, _ in players:
+                if rng.random() < 0.3:
+                    simulation.turn(key, rng.choice(list(Direction)))
+
+            simulation.step()
+            check_board(simulation)
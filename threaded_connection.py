@@ -0,0 +1,121 @@
+import queue
+import socket
+import threading
+
+from connection import Connection
+
+MAX_INBOUND_MESSAGES = 256
+# seconds between two checks of the closed flag while the inbound queue is full
+INBOUND_POLL = 0.1
+
+
+# all socket I/O runs on background threads, the game only polls the inbound queue
+class ThreadedConnection(Connection):
+    def reset(self):
+        super().reset()
+        self.inbound = queue.Queue(MAX_INBOUND_MESSAGES)
+        self.outbound = queue.SimpleQueue()
+
+    def connect(self):
+        player_key = super().connect()
+        threading.Thread(target=self.receive_loop, daemon=True).start()
+        threading.Thread(target=self.send_loop, daemon=True).start()
+
+        return player_key
+
+    def receive_loop(self):
+        while True:
+            try:
+                msg = Connection.receive_message(self)
+            except (ConnectionError, OSError):
+                # queued behind the messages received before, the game thread sets closed when it gets here
+                self.put_inbound(None)
+                break
+
+            if not self.put_inbound(msg):
+                break
+
+    def put_inbound(self, msg):
+        # blocks only this thread when the game falls behind, which stops reading from the socket;
+        # a game that closed the connection reads the queue no more, so the put is given up then
+        while not self.closed:
+            try:
+                self.inbound.put(msg, timeout=INBOUND_POLL)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def receive_data(self):
+        # runs on the receive thread, closed is set by the game thread once it reaches the end of the messages
+        data = self.socket.recv(65536)
+        self.buffer += data
+
+        return len(data) > 0
+
+    def send_loop(self):
+        while True:
+            frames = [self.outbound.get()]
+            while not self.outbound.empty():
+                frames.append(self.outbound.get_nowait())
+
+            # None is queued by close()
+            if None in frames:
+                break
+
+            try:
+                self.writer.write(b"".join(frames))
+                self.writer.flush()
+            except (OSError, ValueError):
+                break
+
+        if not self.closed:
+            # a failed write: the socket is shut down so the receive loop reports the lost connection
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self.outbound.put(None)
+        super().close()
+
+    def send_message(self, msg_type, data):
+        self.outbound.put(self.encode(msg_type, data))
+
+    def receive_message(self):
+        msg = self.inbound.get()
+        if msg is None:
+            self.closed = True
+            raise ConnectionError("Connection closed by server")
+
+        return msg
+
+    def wait_for_data(self, timeout):
+        if self.closed or self.pending:
+            return
+
+        try:
+            msg = self.inbound.get(timeout=timeout)
+        except queue.Empty:
+            return
+
+        if msg is None:
+            self.closed = True
+        else:
+            self.pending.append(self.parse_message(msg))
+
+    def receive_messages(self):
+        messages = []
+        while True:
+            try:
+                msg = self.inbound.get_nowait()
+            except queue.Empty:
+                return messages
+
+            if msg is None:
+                self.closed = True
+                return messages
+
+            messages.append(msg)